@@ -698,15 +698,32 @@ class CloudController(object):
         kwargs['use_v6'] = True
         return self._format_describe_instances(context, **kwargs)
 
-    def _format_describe_instances(self, context, **kwargs):
-        return {'reservationSet': self._format_instances(context, **kwargs)}
+    def _format_describe_instances(self, context, max_results=None,
+                                   next_token=None, **kwargs):
+        if kwargs.get('instance_id') or (max_results is None and
+                                          next_token is None):
+            return {'reservationSet': self._format_instances(context,
+                                                             **kwargs)}
+        # NOTE: pages are read in id order, and the token of the next page
+        #       is the ec2 id of the last instance of this one.
+        marker = None
+        if next_token is not None:
+            marker = ec2utils.ec2_id_to_id(next_token)
+        instances = self.compute_api.get_all(context, limit=max_results,
+                                             marker=marker)
+        result = {'reservationSet': self._format_instances(
+                context, instances=instances, **kwargs)}
+        if max_results and len(instances) == max_results:
+            result['nextToken'] = ec2utils.id_to_ec2_id(instances[-1]['id'])
+        return result
 
     def _format_run_instances(self, context, reservation_id):
         i = self._format_instances(context, reservation_id=reservation_id)
         assert len(i) == 1
         return i[0]
 
-    def _format_instances(self, context, instance_id=None, **kwargs):
+    def _format_instances(self, context, instance_id=None, instances=None,
+                          use_v6=False, **kwargs):
         # TODO(termie): this method is poorly named as its name does not imply
         #               that it will be making a variety of database calls
         #               rather than simply formatting a bunch of instances that
@@ -720,7 +737,7 @@ class CloudController(object):
                 instance = self.compute_api.get(context,
                                                 instance_id=internal_id)
                 instances.append(instance)
-        else:
+        elif instances is None:
             instances = self.compute_api.get_all(context, **kwargs)
         for instance in instances:
             if not context.is_admin:
@@ -741,7 +758,7 @@ class CloudController(object):
                 if instance['fixed_ip']['floating_ips']:
                     fixed = instance['fixed_ip']
                     floating_addr = fixed['floating_ips'][0]['address']
-                if instance['fixed_ip']['network'] and 'use_v6' in kwargs:
+                if instance['fixed_ip']['network'] and use_v6:
                     i['dnsNameV6'] = ipv6.to_global(
                         instance['fixed_ip']['network']['cidr_v6'],
                         instance['mac_address'],
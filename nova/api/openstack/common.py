@@ -36,18 +36,13 @@ XML_NS_V10 = 'http://docs.rackspacecloud.com/servers/api/v1.0'
 XML_NS_V11 = 'http://docs.openstack.org/compute/api/v1.1'
 
 
-def limited(items, request, max_limit=FLAGS.osapi_max_limit):
+def get_limit_and_offset(request, max_limit=FLAGS.osapi_max_limit):
     """
-    Return a slice of items according to requested offset and limit.
+    Return the (limit, offset) requested, the way limited applies them.
 
-    @param items: A sliceable entity
     @param request: `wsgi.Request` possibly containing 'offset' and 'limit'
-                    GET variables. 'offset' is where to start in the list,
-                    and 'limit' is the maximum number of items to return. If
-                    'limit' is not specified, 0, or > max_limit, we default
-                    to max_limit. Negative values for either offset or limit
-                    will cause exc.HTTPBadRequest() exceptions to be raised.
-    @kwarg max_limit: The maximum number of items to return from 'items'
+                    GET variables, see limited.
+    @kwarg max_limit: The maximum number of items to return
     """
     try:
         offset = int(request.GET.get('offset', 0))
@@ -65,13 +60,30 @@ def limited(items, request, max_limit=FLAGS.osapi_max_limit):
     if offset < 0:
         raise webob.exc.HTTPBadRequest(_('offset param must be positive'))
 
-    limit = min(max_limit, limit or max_limit)
+    return min(max_limit, limit or max_limit), offset
+
+
+def limited(items, request, max_limit=FLAGS.osapi_max_limit):
+    """
+    Return a slice of items according to requested offset and limit.
+
+    @param items: A sliceable entity
+    @param request: `wsgi.Request` possibly containing 'offset' and 'limit'
+                    GET variables. 'offset' is where to start in the list,
+                    and 'limit' is the maximum number of items to return. If
+                    'limit' is not specified, 0, or > max_limit, we default
+                    to max_limit. Negative values for either offset or limit
+                    will cause exc.HTTPBadRequest() exceptions to be raised.
+    @kwarg max_limit: The maximum number of items to return from 'items'
+    """
+    limit, offset = get_limit_and_offset(request, max_limit)
     range_end = offset + limit
     return items[offset:range_end]
 
 
-def limited_by_marker(items, request, max_limit=FLAGS.osapi_max_limit):
-    """Return a slice of items according to the requested marker and limit."""
+def get_limit_and_marker(request, max_limit=FLAGS.osapi_max_limit):
+    """Return the (limit, marker) requested, the way limited_by_marker
+    applies them. marker is None when not given."""
 
     try:
         marker = int(request.GET.get('marker', 0))
@@ -86,7 +98,13 @@ def limited_by_marker(items, request, max_limit=FLAGS.osapi_max_limit):
     if limit < 0:
         raise webob.exc.HTTPBadRequest(_('limit param must be positive'))
 
-    limit = min(max_limit, limit)
+    return min(max_limit, limit), marker or None
+
+
+def limited_by_marker(items, request, max_limit=FLAGS.osapi_max_limit):
+    """Return a slice of items according to the requested marker and limit."""
+
+    limit, marker = get_limit_and_marker(request, max_limit)
     start_index = 0
     if marker:
         start_index = -1
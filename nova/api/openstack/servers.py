@@ -84,7 +84,7 @@ class Controller(common.OpenstackController):
     def _get_view_builder(self, req):
         raise NotImplementedError()
 
-    def _limit_items(self, items, req):
+    def _get_paging_params(self, req):
         raise NotImplementedError()
 
     def _action_rebuild(self, info, request, instance_id):
@@ -95,13 +95,49 @@ class Controller(common.OpenstackController):
 
         builder - the response model builder
         """
-        instance_list = self.compute_api.get_all(req.environ['nova.context'])
-        limited_list = self._limit_items(instance_list, req)
+        paging = self._get_paging_params(req)
+        filters = self._get_filters(req)
+        try:
+            instance_list = self.compute_api.get_all(
+                    req.environ['nova.context'], filters=filters, **paging)
+        except exception.InstanceNotFound:
+            raise exc.HTTPBadRequest(_('marker [%s] not found') %
+                                     paging.get('marker'))
         builder = self._get_view_builder(req)
         servers = [builder.build(inst, is_detail)['server']
-                for inst in limited_list]
+                for inst in instance_list]
         return dict(servers=servers)
 
+    def _get_filters(self, req):
+        """Returns the db filters for the status, name, image and
+        changes-since parameters of a server listing."""
+        filters = {}
+        status = req.GET.get('status')
+        if status is not None:
+            statuses = nova.api.openstack.views.servers.POWER_STATE_STATUS
+            states = [state for state, name in statuses.iteritems()
+                      if name == status.upper()]
+            if not states:
+                raise exc.HTTPBadRequest(_('Invalid status %s') % status)
+            filters['state'] = states
+        if 'name' in req.GET:
+            filters['display_name'] = req.GET['name']
+        if 'image' in req.GET:
+            try:
+                filters['image_id'] = common.get_id_from_href(
+                        req.GET['image'])
+            except exc.HTTPBadRequest:
+                raise exc.HTTPBadRequest(_('Invalid image %s') %
+                                         req.GET['image'])
+        if 'changes-since' in req.GET:
+            try:
+                filters['changes_since'] = utils.parse_isotime(
+                        req.GET['changes-since'])
+            except ValueError:
+                raise exc.HTTPBadRequest(_('changes-since must be an'
+                                           ' ISO 8601 time'))
+        return filters
+
     @scheduler_api.redirect_handler
     def show(self, req, id):
         """ Returns server details by server id """
@@ -603,8 +639,9 @@ class ControllerV10(Controller):
         return nova.api.openstack.views.servers.ViewBuilderV10(
             addresses_builder)
 
-    def _limit_items(self, items, req):
-        return common.limited(items, req)
+    def _get_paging_params(self, req):
+        limit, offset = common.get_limit_and_offset(req)
+        return dict(limit=limit, offset=offset)
 
     def _parse_update(self, context, server_id, inst_dict, update_dict):
         if 'adminPass' in inst_dict['server']:
@@ -667,8 +704,9 @@ class ControllerV11(Controller):
         self.compute_api.set_admin_password(context, id, password)
         return exc.HTTPAccepted()
 
-    def _limit_items(self, items, req):
-        return common.limited_by_marker(items, req)
+    def _get_paging_params(self, req):
+        limit, marker = common.get_limit_and_marker(req)
+        return dict(limit=limit, marker=marker)
 
     def _validate_metadata(self, metadata):
         """Ensure that we can work with the metadata given."""
@@ -28,6 +28,22 @@ from nova.api.openstack.views import images as images_view
 from nova import utils
 
 
+# server status by instance power state
+POWER_STATE_STATUS = {
+    None: 'BUILD',
+    power_state.NOSTATE: 'BUILD',
+    power_state.RUNNING: 'ACTIVE',
+    power_state.BLOCKED: 'ACTIVE',
+    power_state.SUSPENDED: 'SUSPENDED',
+    power_state.PAUSED: 'PAUSED',
+    power_state.SHUTDOWN: 'SHUTDOWN',
+    power_state.SHUTOFF: 'SHUTOFF',
+    power_state.CRASHED: 'ERROR',
+    power_state.FAILED: 'ERROR',
+    power_state.BUILDING: 'BUILD',
+}
+
+
 class ViewBuilder(object):
     """Model a server response as a python dictionary.
 
@@ -56,25 +72,11 @@ class ViewBuilder(object):
 
     def _build_detail(self, inst):
         """Returns a detailed model of a server."""
-        power_mapping = {
-            None: 'BUILD',
-            power_state.NOSTATE: 'BUILD',
-            power_state.RUNNING: 'ACTIVE',
-            power_state.BLOCKED: 'ACTIVE',
-            power_state.SUSPENDED: 'SUSPENDED',
-            power_state.PAUSED: 'PAUSED',
-            power_state.SHUTDOWN: 'SHUTDOWN',
-            power_state.SHUTOFF: 'SHUTOFF',
-            power_state.CRASHED: 'ERROR',
-            power_state.FAILED: 'ERROR',
-            power_state.BUILDING: 'BUILD',
-        }
-
         inst_dict = {
             'id': int(inst['id']),
             'name': inst['display_name'],
             'addresses': self.addresses_builder.build(inst),
-            'status': power_mapping[inst.get('state')]}
+            'status': POWER_STATE_STATUS[inst.get('state')]}
 
         ctxt = nova.context.get_admin_context()
         compute_api = nova.compute.API()
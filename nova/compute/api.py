@@ -222,6 +222,7 @@ class API(base.Base):
             'os_type': os_type}
         elevated = context.elevated()
         instances = []
+        instance_ids = []
         LOG.debug(_("Going to run %s instances..."), num_instances)
         for num in range(num_instances):
             instance = dict(mac_address=utils.generate_mac(),
@@ -246,28 +247,29 @@ class API(base.Base):
 
             instance = self.update(context, instance_id, **updates)
             instances.append(instance)
+            instance_ids.append(instance_id)
+
+        pid = context.project_id
+        uid = context.user_id
+        LOG.debug(_("Casting to scheduler for %(pid)s/%(uid)s's"
+                " instances %(instance_ids)s") % locals())
+
+        # NOTE(sandy): For now we're just going to pass in the
+        # instance_type record to the scheduler. In a later phase
+        # we'll be ripping this whole for-loop out and deferring the
+        # creation of the Instance record. At that point all this will
+        # change.
+        rpc.cast(context,
+                 FLAGS.scheduler_topic,
+                 {"method": "run_instances",
+                  "args": {"topic": FLAGS.compute_topic,
+                           "instance_ids": instance_ids,
+                           "instance_type": instance_type,
+                           "availability_zone": availability_zone,
+                           "injected_files": injected_files}})
 
-            pid = context.project_id
-            uid = context.user_id
-            LOG.debug(_("Casting to scheduler for %(pid)s/%(uid)s's"
-                    " instance %(instance_id)s") % locals())
-
-            # NOTE(sandy): For now we're just going to pass in the
-            # instance_type record to the scheduler. In a later phase
-            # we'll be ripping this whole for-loop out and deferring the
-            # creation of the Instance record. At that point all this will
-            # change.
-            rpc.cast(context,
-                     FLAGS.scheduler_topic,
-                     {"method": "run_instance",
-                      "args": {"topic": FLAGS.compute_topic,
-                               "instance_id": instance_id,
-                               "instance_type": instance_type,
-                               "availability_zone": availability_zone,
-                               "injected_files": injected_files}})
-
-        for group_id in security_groups:
-            self.trigger_security_group_members_refresh(elevated, group_id)
+        self.trigger_security_group_members_refresh(elevated,
+                                                    *security_groups)
 
         return [dict(x.iteritems()) for x in instances]
 
@@ -315,47 +317,54 @@ class API(base.Base):
                      {"method": "refresh_security_group_rules",
                       "args": {"security_group_id": security_group.id}})
 
-    def trigger_security_group_members_refresh(self, context, group_id):
-        """Called when a security group gains a new or loses a member.
+    def trigger_security_group_members_refresh(self, context, *group_ids):
+        """Called when security groups gain a new or lose a member.
 
         Sends an update request to each compute node for whom this is
-        relevant.
+        relevant, batching the requests for all of group_ids that go to
+        the same node.
 
         """
-        # First, we get the security group rules that reference this group as
-        # the grantee..
-        security_group_rules = \
+        group_ids_by_host = {}
+        for group_id in group_ids:
+            # First, we get the security group rules that reference this
+            # group as the grantee..
+            security_group_rules = \
                 self.db.security_group_rule_get_by_security_group_grantee(
                                                                      context,
                                                                      group_id)
 
-        # ..then we distill the security groups to which they belong..
-        security_groups = set()
-        for rule in security_group_rules:
-            security_group = self.db.security_group_get(
+            # ..then we distill the security groups to which they belong..
+            security_groups = set()
+            for rule in security_group_rules:
+                security_group = self.db.security_group_get(
                                                     context,
                                                     rule['parent_group_id'])
-            security_groups.add(security_group)
-
-        # ..then we find the instances that are members of these groups..
-        instances = set()
-        for security_group in security_groups:
-            for instance in security_group['instances']:
-                instances.add(instance)
-
-        # ...then we find the hosts where they live...
-        hosts = set()
-        for instance in instances:
-            if instance['host']:
-                hosts.add(instance['host'])
-
-        # ...and finally we tell these nodes to refresh their view of this
-        # particular security group.
-        for host in hosts:
-            rpc.cast(context,
-                     self.db.queue_get_for(context, FLAGS.compute_topic, host),
-                     {"method": "refresh_security_group_members",
-                      "args": {"security_group_id": group_id}})
+                security_groups.add(security_group)
+
+            # ..then we find the instances that are members of these groups..
+            instances = set()
+            for security_group in security_groups:
+                for instance in security_group['instances']:
+                    instances.add(instance)
+
+            # ...then we find the hosts where they live...
+            for instance in instances:
+                if instance['host']:
+                    host_group_ids = group_ids_by_host.setdefault(
+                            instance['host'], [])
+                    if group_id not in host_group_ids:
+                        host_group_ids.append(group_id)
+
+        # ...and finally we tell these nodes to refresh their view of these
+        # particular security groups.
+        for host, host_group_ids in group_ids_by_host.iteritems():
+            rpc.cast_many(context,
+                          self.db.queue_get_for(context, FLAGS.compute_topic,
+                                                host),
+                          [{"method": "refresh_security_group_members",
+                            "args": {"security_group_id": group_id}}
+                           for group_id in host_group_ids])
 
     def update(self, context, instance_id, **kwargs):
         """Updates the instance in the datastore.
@@ -422,12 +431,17 @@ class API(base.Base):
         return self.get(context, instance_id)
 
     def get_all(self, context, project_id=None, reservation_id=None,
-                fixed_ip=None):
+                fixed_ip=None, limit=None, marker=None, offset=None,
+                sort_dir='asc', filters=None):
         """Get all instances filtered by one of the given parameters.
 
         If there is no filter and the context is an admin, it will retreive
         all instances in the system.
 
+        The listings of a user, a project or the whole system are paged
+        and filtered in the database by limit, marker, offset, sort_dir
+        and filters, see db.instance_get_all.
+
         """
         if reservation_id is not None:
             return self.db.instance_get_all_by_reservation(
@@ -436,18 +450,20 @@ class API(base.Base):
         if fixed_ip is not None:
             return self.db.fixed_ip_get_instance(context, fixed_ip)
 
+        paging = dict(limit=limit, marker=marker, offset=offset,
+                      sort_dir=sort_dir, filters=filters)
         if project_id or not context.is_admin:
             if not context.project:
                 return self.db.instance_get_all_by_user(
-                    context, context.user_id)
+                    context, context.user_id, **paging)
 
             if project_id is None:
                 project_id = context.project_id
 
             return self.db.instance_get_all_by_project(
-                context, project_id)
+                context, project_id, **paging)
 
-        return self.db.instance_get_all(context)
+        return self.db.instance_get_all(context, **paging)
 
     def _cast_compute_message(self, method, context, instance_id, host=None,
                               params=None):
@@ -28,6 +28,9 @@ The underlying driver is loaded as a :class:`LazyPluggable`.
 :sql_connection:  string specifying the sqlalchemy connection to use, like:
                   `sqlite:///var/lib/nova/nova.sqlite`.
 
+:sql_thread_pool:  run db calls in native threads instead of the eventlet
+                   hub, at most `sql_thread_pool_size` at once.
+
 :enable_new_services:  when adding a new service to the database, is it in the
                        pool of available hardware (Default: True)
 
@@ -36,6 +39,7 @@ The underlying driver is loaded as a :class:`LazyPluggable`.
 from nova import exception
 from nova import flags
 from nova import utils
+from nova.db import threadpool
 
 
 FLAGS = flags.FLAGS
@@ -49,8 +53,9 @@ flags.DEFINE_string('volume_name_template', 'volume-%08x',
                     'Template string to be used to generate instance names')
 
 
-IMPL = utils.LazyPluggable(FLAGS['db_backend'],
-                           sqlalchemy='nova.db.sqlalchemy.api')
+IMPL = threadpool.ThreadPooledBackend(
+        utils.LazyPluggable(FLAGS['db_backend'],
+                            sqlalchemy='nova.db.sqlalchemy.api'))
 
 
 class NoMoreAddresses(exception.Error):
@@ -231,11 +236,40 @@ def floating_ip_allocate_address(context, host, project_id):
     return IMPL.floating_ip_allocate_address(context, host, project_id)
 
 
+def floating_ip_get_free(context, host, limit):
+    """Get (id, address) of up to limit free floating ips of host.
+
+    The floating ips are ordered by id.
+
+    """
+    return IMPL.floating_ip_get_free(context, host, limit)
+
+
+def floating_ip_allocate_if_free(context, floating_ip_id, project_id):
+    """Allocate the floating ip to project_id if it is still free.
+
+    Returns whether it was.
+
+    """
+    return IMPL.floating_ip_allocate_if_free(context, floating_ip_id,
+                                             project_id)
+
+
 def floating_ip_create(context, values):
     """Create a floating ip from the values dictionary."""
     return IMPL.floating_ip_create(context, values)
 
 
+def floating_ip_bulk_create(context, ips):
+    """Create a floating ip from each values dictionary in ips.
+
+    The floating ips are inserted many rows at a time in one
+    transaction. Every dictionary must have the same keys.
+
+    """
+    return IMPL.floating_ip_bulk_create(context, ips)
+
+
 def floating_ip_count_by_project(context, project_id):
     """Count floating ips used by project."""
     return IMPL.floating_ip_count_by_project(context, project_id)
@@ -340,11 +374,40 @@ def fixed_ip_associate_pool(context, network_id, instance_id):
     return IMPL.fixed_ip_associate_pool(context, network_id, instance_id)
 
 
+def fixed_ip_get_free(context, network_id, limit):
+    """Get (id, address) of up to limit free ips of network or of no network.
+
+    The fixed ips are ordered by id.
+
+    """
+    return IMPL.fixed_ip_get_free(context, network_id, limit)
+
+
+def fixed_ip_associate_if_free(context, fixed_ip_id, network_id, instance_id):
+    """Associate the fixed ip to network and instance if it is still free.
+
+    Returns whether it was.
+
+    """
+    return IMPL.fixed_ip_associate_if_free(context, fixed_ip_id, network_id,
+                                           instance_id)
+
+
 def fixed_ip_create(context, values):
     """Create a fixed ip from the values dictionary."""
     return IMPL.fixed_ip_create(context, values)
 
 
+def fixed_ip_bulk_create(context, ips):
+    """Create a fixed ip from each values dictionary in ips.
+
+    The fixed ips are inserted many rows at a time in one
+    transaction. Every dictionary must have the same keys.
+
+    """
+    return IMPL.fixed_ip_bulk_create(context, ips)
+
+
 def fixed_ip_disassociate(context, address):
     """Disassociate a fixed ip from an instance by address."""
     return IMPL.fixed_ip_disassociate(context, address)
@@ -417,19 +480,46 @@ def instance_get(context, instance_id):
     return IMPL.instance_get(context, instance_id)
 
 
-def instance_get_all(context):
-    """Get all instances."""
-    return IMPL.instance_get_all(context)
+def instance_get_all(context, limit=None, marker=None, offset=None,
+                     sort_dir='asc', filters=None):
+    """Get all instances, ordered by id.
+
+    The paging arguments are applied by the database:
 
+    :limit: return at most this many instances.
+    :marker: id of the last instance of the previous page; instances
+             after it in the sort order are returned. Raises
+             InstanceNotFound if there is no such instance to list.
+    :offset: skip this many instances.
+    :sort_dir: 'asc' or 'desc' by id.
+    :filters: dictionary of conditions the instances must meet, with
+              any of the keys 'state' (a power state or list of them),
+              'display_name', 'image_id' and 'changes_since' (a datetime
+              the instance was last updated at or after).
+    """
+    return IMPL.instance_get_all(context, limit=limit, marker=marker,
+                                 offset=offset, sort_dir=sort_dir,
+                                 filters=filters)
 
-def instance_get_all_by_user(context, user_id):
-    """Get all instances."""
-    return IMPL.instance_get_all_by_user(context, user_id)
 
+def instance_get_all_by_user(context, user_id, limit=None, marker=None,
+                             offset=None, sort_dir='asc', filters=None):
+    """Get all instances of a user, paged like instance_get_all."""
+    return IMPL.instance_get_all_by_user(context, user_id, limit=limit,
+                                         marker=marker, offset=offset,
+                                         sort_dir=sort_dir, filters=filters)
 
-def instance_get_all_by_project(context, project_id):
-    """Get all instance belonging to a project."""
-    return IMPL.instance_get_all_by_project(context, project_id)
+
+def instance_get_all_by_project(context, project_id, limit=None,
+                                marker=None, offset=None, sort_dir='asc',
+                                filters=None):
+    """Get all instance belonging to a project, paged like
+    instance_get_all."""
+    return IMPL.instance_get_all_by_project(context, project_id,
+                                            limit=limit, marker=marker,
+                                            offset=offset,
+                                            sort_dir=sort_dir,
+                                            filters=filters)
 
 
 def instance_get_all_by_host(context, host):
@@ -475,6 +565,16 @@ def instance_update(context, instance_id, values):
     return IMPL.instance_update(context, instance_id, values)
 
 
+def instance_update_hosts(context, instance_hosts, values):
+    """Set the host of many instances in one transaction.
+
+    instance_hosts maps instance ids to hosts. values are set on
+    every one of the instances as well.
+
+    """
+    return IMPL.instance_update_hosts(context, instance_hosts, values)
+
+
 def instance_add_security_group(context, instance_id, security_group_id):
     """Associate the given security group with the given instance."""
     return IMPL.instance_add_security_group(context, instance_id,
@@ -29,6 +29,7 @@ from nova import ipv6
 from nova import utils
 from nova.db.sqlalchemy import models
 from nova.db.sqlalchemy.session import get_session
+from sqlalchemy import and_
 from sqlalchemy import or_
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import joinedload
@@ -38,6 +39,9 @@ from sqlalchemy.sql import func
 from sqlalchemy.sql.expression import literal_column
 
 FLAGS = flags.FLAGS
+flags.DEFINE_integer('sql_bulk_insert_rows', 1000,
+                     'Rows per INSERT statement when many rows are'
+                     ' created at once')
 
 
 def is_admin_context(context):
@@ -111,6 +115,16 @@ def require_context(f):
     return wrapper
 
 
+def _bulk_insert(session, model, rows):
+    """Insert rows, a list of values dictionaries with the same keys, into
+    the table of model with one executemany per sql_bulk_insert_rows rows,
+    which the MySQL driver sends as a multi-row INSERT."""
+    table = model.__table__
+    chunk = FLAGS.sql_bulk_insert_rows
+    for start in xrange(0, len(rows), chunk):
+        session.execute(table.insert(), rows[start:start + chunk])
+
+
 ###################
 
 @require_admin_context
@@ -446,6 +460,34 @@ def floating_ip_allocate_address(context, host, project_id):
     return floating_ip_ref['address']
 
 
+@require_context
+def floating_ip_get_free(context, host, limit):
+    session = get_session()
+    return session.query(models.FloatingIp.id, models.FloatingIp.address).\
+                   filter_by(host=host).\
+                   filter_by(fixed_ip_id=None).\
+                   filter_by(project_id=None).\
+                   filter_by(deleted=False).\
+                   order_by(models.FloatingIp.id).\
+                   limit(limit).\
+                   all()
+
+
+@require_context
+def floating_ip_allocate_if_free(context, floating_ip_id, project_id):
+    authorize_project_context(context, project_id)
+    session = get_session()
+    with session.begin():
+        count = session.query(models.FloatingIp).\
+                        filter_by(id=floating_ip_id).\
+                        filter_by(fixed_ip_id=None).\
+                        filter_by(project_id=None).\
+                        filter_by(deleted=False).\
+                        update({'project_id': project_id},
+                               synchronize_session=False)
+    return count == 1
+
+
 @require_context
 def floating_ip_create(context, values):
     floating_ip_ref = models.FloatingIp()
@@ -454,6 +496,13 @@ def floating_ip_create(context, values):
     return floating_ip_ref['address']
 
 
+@require_context
+def floating_ip_bulk_create(context, ips):
+    session = get_session()
+    with session.begin():
+        _bulk_insert(session, models.FloatingIp, ips)
+
+
 @require_context
 def floating_ip_count_by_project(context, project_id):
     authorize_project_context(context, project_id)
@@ -642,6 +691,36 @@ def fixed_ip_associate_pool(context, network_id, instance_id):
     return fixed_ip_ref['address']
 
 
+@require_admin_context
+def fixed_ip_get_free(context, network_id, limit):
+    session = get_session()
+    network_or_none = or_(models.FixedIp.network_id == network_id,
+                          models.FixedIp.network_id == None)
+    return session.query(models.FixedIp.id, models.FixedIp.address).\
+                   filter(network_or_none).\
+                   filter_by(reserved=False).\
+                   filter_by(deleted=False).\
+                   filter_by(instance_id=None).\
+                   order_by(models.FixedIp.id).\
+                   limit(limit).\
+                   all()
+
+
+@require_admin_context
+def fixed_ip_associate_if_free(context, fixed_ip_id, network_id, instance_id):
+    session = get_session()
+    with session.begin():
+        count = session.query(models.FixedIp).\
+                        filter_by(id=fixed_ip_id).\
+                        filter_by(reserved=False).\
+                        filter_by(deleted=False).\
+                        filter_by(instance_id=None).\
+                        update({'instance_id': instance_id,
+                                'network_id': network_id},
+                               synchronize_session=False)
+    return count == 1
+
+
 @require_context
 def fixed_ip_create(_context, values):
     fixed_ip_ref = models.FixedIp()
@@ -650,6 +729,13 @@ def fixed_ip_create(_context, values):
     return fixed_ip_ref['address']
 
 
+@require_context
+def fixed_ip_bulk_create(_context, ips):
+    session = get_session()
+    with session.begin():
+        _bulk_insert(session, models.FixedIp, ips)
+
+
 @require_context
 def fixed_ip_disassociate(context, address):
     session = get_session()
@@ -866,31 +952,83 @@ def instance_get(context, instance_id, session=None):
     return result
 
 
+def _instance_get_page(query, limit=None, marker=None, offset=None,
+                       sort_dir='asc', filters=None):
+    """Returns the page of the instances of query selected by the paging
+    arguments of instance_get_all, in sql.
+
+    query selects the instances the caller may list. Instances are
+    ordered by id, and marker is the id of the last instance of the
+    previous page. It has to be one of the instances of query, filters
+    aside, or InstanceNotFound is raised.
+    """
+    if sort_dir not in ('asc', 'desc'):
+        raise exception.InvalidInput(reason=_('sort_dir must be asc or desc'))
+    if marker is not None:
+        if not query.enable_eagerloads(False).filter_by(id=marker).count():
+            raise exception.InstanceNotFound(instance_id=marker)
+
+    filters = filters or {}
+    if 'state' in filters:
+        states = filters['state']
+        if not isinstance(states, (list, tuple, set)):
+            states = [states]
+        state_filter = models.Instance.state.in_(
+                [state for state in states if state is not None])
+        if None in states:
+            state_filter = or_(state_filter, models.Instance.state == None)
+        query = query.filter(state_filter)
+    if 'display_name' in filters:
+        query = query.filter_by(display_name=filters['display_name'])
+    if 'image_id' in filters:
+        query = query.filter_by(image_id=str(filters['image_id']))
+    if 'changes_since' in filters:
+        changes_since = filters['changes_since']
+        query = query.filter(or_(
+                models.Instance.updated_at >= changes_since,
+                and_(models.Instance.updated_at == None,
+                     models.Instance.created_at >= changes_since)))
+
+    if sort_dir == 'desc':
+        if marker is not None:
+            query = query.filter(models.Instance.id < marker)
+        query = query.order_by(models.Instance.id.desc())
+    else:
+        if marker is not None:
+            query = query.filter(models.Instance.id > marker)
+        query = query.order_by(models.Instance.id)
+    if offset:
+        query = query.offset(offset)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+
 @require_admin_context
-def instance_get_all(context):
+def instance_get_all(context, **paging):
     session = get_session()
-    return session.query(models.Instance).\
-                   options(joinedload_all('fixed_ip.floating_ips')).\
-                   options(joinedload('security_groups')).\
-                   options(joinedload_all('fixed_ip.network')).\
-                   options(joinedload('metadata')).\
-                   options(joinedload('instance_type')).\
-                   filter_by(deleted=can_read_deleted(context)).\
-                   all()
+    query = session.query(models.Instance).\
+                    options(joinedload_all('fixed_ip.floating_ips')).\
+                    options(joinedload('security_groups')).\
+                    options(joinedload_all('fixed_ip.network')).\
+                    options(joinedload('metadata')).\
+                    options(joinedload('instance_type')).\
+                    filter_by(deleted=can_read_deleted(context))
+    return _instance_get_page(query, **paging)
 
 
 @require_admin_context
-def instance_get_all_by_user(context, user_id):
+def instance_get_all_by_user(context, user_id, **paging):
     session = get_session()
-    return session.query(models.Instance).\
-                   options(joinedload_all('fixed_ip.floating_ips')).\
-                   options(joinedload('security_groups')).\
-                   options(joinedload_all('fixed_ip.network')).\
-                   options(joinedload('metadata')).\
-                   options(joinedload('instance_type')).\
-                   filter_by(deleted=can_read_deleted(context)).\
-                   filter_by(user_id=user_id).\
-                   all()
+    query = session.query(models.Instance).\
+                    options(joinedload_all('fixed_ip.floating_ips')).\
+                    options(joinedload('security_groups')).\
+                    options(joinedload_all('fixed_ip.network')).\
+                    options(joinedload('metadata')).\
+                    options(joinedload('instance_type')).\
+                    filter_by(deleted=can_read_deleted(context)).\
+                    filter_by(user_id=user_id)
+    return _instance_get_page(query, **paging)
 
 
 @require_admin_context
@@ -907,18 +1045,18 @@ def instance_get_all_by_host(context, host):
 
 
 @require_context
-def instance_get_all_by_project(context, project_id):
+def instance_get_all_by_project(context, project_id, **paging):
     authorize_project_context(context, project_id)
 
     session = get_session()
-    return session.query(models.Instance).\
-                   options(joinedload_all('fixed_ip.floating_ips')).\
-                   options(joinedload('security_groups')).\
-                   options(joinedload_all('fixed_ip.network')).\
-                   options(joinedload('instance_type')).\
-                   filter_by(project_id=project_id).\
-                   filter_by(deleted=can_read_deleted(context)).\
-                   all()
+    query = session.query(models.Instance).\
+                    options(joinedload_all('fixed_ip.floating_ips')).\
+                    options(joinedload('security_groups')).\
+                    options(joinedload_all('fixed_ip.network')).\
+                    options(joinedload('instance_type')).\
+                    filter_by(project_id=project_id).\
+                    filter_by(deleted=can_read_deleted(context))
+    return _instance_get_page(query, **paging)
 
 
 @require_context
@@ -1016,6 +1154,20 @@ def instance_update(context, instance_id, values):
         return instance_ref
 
 
+@require_admin_context
+def instance_update_hosts(context, instance_hosts, values):
+    instance_ids_by_host = {}
+    for instance_id, host in instance_hosts.iteritems():
+        instance_ids_by_host.setdefault(host, []).append(instance_id)
+    session = get_session()
+    with session.begin():
+        for host, instance_ids in instance_ids_by_host.iteritems():
+            session.query(models.Instance).\
+                    filter(models.Instance.id.in_(instance_ids)).\
+                    update(dict(values, host=host),
+                           synchronize_session=False)
+
+
 def instance_add_security_group(context, instance_id, security_group_id):
     """Associate the given security group with the given instance"""
     session = get_session()
@@ -0,0 +1,81 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import Index, MetaData, Table
+
+meta = MetaData()
+
+# (index name, table, columns), following the filters of the queries in
+# nova/db/sqlalchemy/api.py: equality columns first, then deleted and the
+# remaining flags. The instance_id indexes serve the joins of the
+# instance listings.
+INDEXES = [
+    ('instances_project_id_deleted_idx', 'instances',
+     ('project_id', 'deleted')),
+    ('instances_host_deleted_idx', 'instances',
+     ('host', 'deleted')),
+    ('instances_reservation_id_deleted_idx', 'instances',
+     ('reservation_id', 'deleted')),
+    ('fixed_ips_address_deleted_idx', 'fixed_ips',
+     ('address', 'deleted')),
+    ('fixed_ips_network_id_instance_id_deleted_idx', 'fixed_ips',
+     ('network_id', 'instance_id', 'deleted', 'reserved')),
+    ('fixed_ips_instance_id_idx', 'fixed_ips',
+     ('instance_id',)),
+    ('floating_ips_address_deleted_idx', 'floating_ips',
+     ('address', 'deleted')),
+    ('floating_ips_host_project_id_fixed_ip_id_idx', 'floating_ips',
+     ('host', 'project_id', 'fixed_ip_id', 'deleted')),
+    ('floating_ips_project_id_deleted_idx', 'floating_ips',
+     ('project_id', 'deleted')),
+    ('floating_ips_fixed_ip_id_idx', 'floating_ips',
+     ('fixed_ip_id',)),
+    ('services_topic_deleted_disabled_idx', 'services',
+     ('topic', 'deleted', 'disabled')),
+    ('services_host_topic_deleted_idx', 'services',
+     ('host', 'topic', 'deleted')),
+    ('security_group_instance_association_instance_id_idx',
+     'security_group_instance_association',
+     ('instance_id',)),
+    ('instance_metadata_instance_id_idx', 'instance_metadata',
+     ('instance_id',)),
+    ]
+
+
+def _indexes(migrate_engine):
+    tables = {}
+    for name, table_name, columns in INDEXES:
+        if table_name not in tables:
+            tables[table_name] = Table(table_name, meta, autoload=True,
+                                       autoload_with=migrate_engine)
+        table = tables[table_name]
+        yield Index(name, *[table.c[column] for column in columns])
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine;
+    # bind migrate_engine to your metadata
+    meta.bind = migrate_engine
+
+    for index in _indexes(migrate_engine):
+        index.create(migrate_engine)
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+
+    for index in _indexes(migrate_engine):
+        index.drop(migrate_engine)
@@ -43,6 +43,10 @@ def get_session(autocommit=True, expire_on_commit=False):
 
             if FLAGS.sql_connection.startswith('sqlite'):
                 kwargs['poolclass'] = pool.NullPool
+            elif FLAGS.sql_thread_pool:
+                # NOTE: one connection per thread of the db thread pool,
+                # so pool threads never wait on the connection pool.
+                kwargs['pool_size'] = FLAGS.sql_thread_pool_size
 
             _ENGINE = create_engine(FLAGS.sql_connection,
                                     **kwargs)
@@ -0,0 +1,162 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Runs db api calls in native threads.
+
+The MySQL driver blocks in C, so a db call made from a greenthread stalls
+the eventlet hub, and every other greenthread of the service with it,
+until the query returns. With the sql_thread_pool flag set, each call
+through nova.db runs in eventlet's tpool instead, and the calling
+greenthread yields until the result is back.
+
+At most sql_thread_pool_size calls run at once; session.get_session sizes
+the connection pool to match so a thread never waits for a connection.
+Callers beyond that wait on a semaphore in the hub, and the time they
+wait is kept in STATS. Services log STATS every
+sql_thread_pool_stats_interval seconds, and nova-manage service
+db_pool_stats shows them.
+"""
+
+import functools
+import time
+import types
+
+from eventlet import patcher
+from eventlet import semaphore
+from eventlet import tpool
+
+from nova import flags
+from nova import log as logging
+
+LOG = logging.getLogger('nova.db.threadpool')
+
+FLAGS = flags.FLAGS
+
+_threading = patcher.original('threading')
+
+
+class PoolStats(object):
+    """Counts of db calls run in the pool and of the time they waited for
+       a free thread."""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.running = 0
+
+    def record_wait(self, seconds):
+        """Counts a call, and a wait if it had to wait seconds for a free
+           thread. Calls admitted right away pass 0."""
+        self.calls += 1
+        if seconds > 0:
+            self.waits += 1
+            self.wait_time += seconds
+            self.max_wait = max(self.max_wait, seconds)
+
+    def to_dict(self):
+        average = 0.0
+        if self.calls:
+            average = self.wait_time / self.calls
+        return {'calls': self.calls,
+                'waits': self.waits,
+                'wait_time': self.wait_time,
+                'average_wait': average,
+                'max_wait': self.max_wait,
+                'running': self.running}
+
+
+STATS = PoolStats()
+
+
+class ThreadPool(object):
+    """Runs functions in tpool, at most size of them at once."""
+    def __init__(self, size, stats=STATS):
+        self.size = size
+        self.semaphore = semaphore.Semaphore(size)
+        self.stats = stats
+        self.local = _threading.local()
+
+    def execute(self, f, *args, **kwargs):
+        """Return f(*args, **kwargs) run in a pool thread. Calls made
+           from a pool thread, like a db api function calling another one
+           through nova.db, run directly in that thread."""
+        if getattr(self.local, 'in_pool', False):
+            return f(*args, **kwargs)
+        if self.semaphore.acquire(blocking=False):
+            self.stats.record_wait(0)
+        else:
+            start = time.time()
+            self.semaphore.acquire()
+            self.stats.record_wait(time.time() - start)
+        self.stats.running += 1
+        try:
+            return tpool.execute(self._run, f, *args, **kwargs)
+        finally:
+            self.stats.running -= 1
+            self.semaphore.release()
+
+    def _run(self, f, *args, **kwargs):
+        self.local.in_pool = True
+        try:
+            return f(*args, **kwargs)
+        finally:
+            self.local.in_pool = False
+
+
+def log_stats():
+    """Logs a line with the counts of STATS, to size sql_thread_pool_size
+       by."""
+    LOG.info(_('DB thread pool: calls=%(calls)d waits=%(waits)d '
+               'average_wait=%(average_wait).4f max_wait=%(max_wait).4f '
+               'running=%(running)d'), STATS.to_dict())
+
+
+_POOL = None
+
+
+def get_pool():
+    """The pool for db calls, created on first use with
+       sql_thread_pool_size threads."""
+    global _POOL
+    if _POOL is None:
+        LOG.debug(_('Running db calls in %d threads'),
+                  FLAGS.sql_thread_pool_size)
+        _POOL = ThreadPool(FLAGS.sql_thread_pool_size)
+    return _POOL
+
+
+class ThreadPooledBackend(object):
+    """Wraps a db backend so its functions run in the pool while the
+       sql_thread_pool flag is set."""
+    def __init__(self, backend):
+        self.__backend = backend
+
+    def __getattr__(self, key):
+        attr = getattr(self.__backend, key)
+        if (not FLAGS.sql_thread_pool or
+                not isinstance(attr, types.FunctionType)):
+            return attr
+
+        @functools.wraps(attr)
+        def wrapper(*args, **kwargs):
+            return get_pool().execute(attr, *args, **kwargs)
+        return wrapper
@@ -22,6 +22,7 @@ import Queue as queue
 
 from carrot.backends import base
 from eventlet import greenthread
+from eventlet import queue as green_queue
 
 from nova import log as logging
 
@@ -61,7 +62,7 @@ class Exchange(object):
 class Queue(object):
     def __init__(self, name):
         self.name = name
-        self._queue = queue.Queue()
+        self._queue = green_queue.LightQueue()
 
     def __repr__(self):
         return '<Queue: %s>' % self.name
@@ -72,8 +73,8 @@ class Queue(object):
     def size(self):
         return self._queue.qsize()
 
-    def pop(self):
-        return self._queue.get()
+    def pop(self, block=False):
+        return self._queue.get(block=block)
 
 
 class Backend(base.BaseBackend):
@@ -102,17 +103,23 @@ class Backend(base.BaseBackend):
 
     def consume(self, limit=None):
         while True:
-            item = self.get(self.current_queue)
+            item = self._get(self.current_queue, block=True)
             if item:
                 self.current_callback(item)
                 raise StopIteration()
             greenthread.sleep(0)
 
     def get(self, queue, no_ack=False):
+        return self._get(queue)
+
+    def _get(self, queue, block=False):
         global QUEUES
-        if not queue in QUEUES or not QUEUES[queue].size():
+        if not queue in QUEUES:
+            return None
+        if not block and not QUEUES[queue].size():
             return None
-        (message_data, content_type, content_encoding) = QUEUES[queue].pop()
+        message_data, content_type, content_encoding = \
+                QUEUES[queue].pop(block=block)
         message = Message(backend=self, body=message_data,
                           content_type=content_type,
                           content_encoding=content_encoding)
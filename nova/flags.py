@@ -348,6 +348,16 @@ DEFINE_integer('sql_idle_timeout',
               'timeout for idle sql database connections')
 DEFINE_integer('sql_max_retries', 12, 'sql connection attempts')
 DEFINE_integer('sql_retry_interval', 10, 'sql connection retry interval')
+DEFINE_bool('sql_thread_pool', False,
+            'Run db calls in native threads so they do not block'
+            ' the eventlet hub')
+DEFINE_integer('sql_thread_pool_size', 10,
+               'Maximum number of db calls running at once with'
+               ' sql_thread_pool, and the size of the sql connection pool.'
+               ' Keep it at or below EVENTLET_THREADPOOL_SIZE (20)')
+DEFINE_integer('sql_thread_pool_stats_interval', 0,
+               'Seconds between logging the waits for a free thread of'
+               ' sql_thread_pool, 0 to never log them')
 
 DEFINE_string('compute_manager', 'nova.compute.manager.ComputeManager',
               'Manager for compute')
@@ -53,14 +53,22 @@ This module provides Manager, a base class for managers.
 
 """
 
+import datetime
+
 from nova import flags
 from nova import log as logging
+from nova import rpc
 from nova import utils
 from nova.db import base
+from nova.db import threadpool
 from nova.scheduler import api
 
 
 FLAGS = flags.FLAGS
+flags.DEFINE_integer('capabilities_full_update_interval', 600,
+                     'Seconds between full snapshots of the service'
+                     ' capabilities sent to the schedulers, even when'
+                     ' nothing changed')
 
 
 LOG = logging.getLogger('nova.manager')
@@ -85,6 +93,14 @@ class Manager(base.Base):
         """
         pass
 
+    def get_rpc_stats(self, context):
+        """Returns the RPC statistics of this service."""
+        return rpc.STATS.report()
+
+    def get_db_pool_stats(self, context):
+        """Returns the db thread pool statistics of this service."""
+        return threadpool.STATS.to_dict()
+
 
 class SchedulerDependentManager(Manager):
     """Periodically send capability updates to the Scheduler services.
@@ -94,10 +110,19 @@ class SchedulerDependentManager(Manager):
     manager.Manager directly. Updates are only sent after
     update_service_capabilities is called with non-None values.
 
+    Only the capabilities that changed since the last update are sent,
+    numbered so the schedulers can tell when they missed one, and
+    nothing is sent when nothing changed. A full snapshot is sent
+    first, every capabilities_full_update_interval seconds and when a
+    scheduler asks for one with publish_service_capabilities.
+
     """
 
     def __init__(self, host=None, db_driver=None, service_name='undefined'):
         self.last_capabilities = None
+        self.published_capabilities = None
+        self.published_at = None
+        self.capabilities_sequence = 0
         self.service_name = service_name
         super(SchedulerDependentManager, self).__init__(host, db_driver)
 
@@ -105,11 +130,44 @@ class SchedulerDependentManager(Manager):
         """Remember these capabilities to send on next periodic update."""
         self.last_capabilities = capabilities
 
+    def publish_service_capabilities(self, context):
+        """Send a full snapshot of the capabilities to the schedulers."""
+        if self.last_capabilities:
+            self._publish_capabilities(context, full=True)
+
+    def _full_update_due(self):
+        if self.published_capabilities is None:
+            return True
+        elapsed = utils.utcnow() - self.published_at
+        return elapsed >= datetime.timedelta(
+                seconds=FLAGS.capabilities_full_update_interval)
+
+    def _publish_capabilities(self, context, full=False):
+        capabilities = self.last_capabilities
+        previous = self.published_capabilities
+        full = full or self._full_update_due()
+        if full:
+            changed = capabilities
+            removed = []
+        else:
+            changed = dict((key, value)
+                           for key, value in capabilities.iteritems()
+                           if key not in previous or previous[key] != value)
+            removed = [key for key in previous if key not in capabilities]
+            if not changed and not removed:
+                return
+        self.capabilities_sequence += 1
+        LOG.debug(_('Notifying Schedulers of capabilities ...'))
+        api.update_service_capabilities(context, self.service_name,
+                self.host, changed, sequence=self.capabilities_sequence,
+                removed=removed, full=full)
+        self.published_capabilities = dict(capabilities)
+        if full:
+            self.published_at = utils.utcnow()
+
     def periodic_tasks(self, context=None):
         """Pass data back to the scheduler at a periodic interval."""
         if self.last_capabilities:
-            LOG.debug(_('Notifying Schedulers of capabilities ...'))
-            api.update_service_capabilities(context, self.service_name,
-                                self.host, self.last_capabilities)
+            self._publish_capabilities(context)
 
         super(SchedulerDependentManager, self).periodic_tasks(context)
@@ -0,0 +1,93 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Hands out fixed and floating ips without row locks.
+
+A batch of free addresses is read without locking, and an address is
+claimed with an UPDATE that only matches while the address is still
+free. Concurrent allocators that read the same batch therefore never
+hand out the same address, and the one that loses a race moves on to
+another address of the batch instead of waiting for a lock. This also
+holds on databases without SELECT ... FOR UPDATE, like sqlite.
+"""
+
+import random
+
+from nova import db
+from nova import flags
+from nova import log as logging
+
+LOG = logging.getLogger('nova.network.allocator')
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('ip_allocation_batch', 32,
+                     'Number of free addresses read at a time when'
+                     ' allocating an ip')
+
+
+class AddressAllocator(object):
+    """Allocates addresses through a db api with get_free and *_if_free
+    calls, nova.db by default."""
+
+    def __init__(self, db_api=None):
+        self.db = db_api or db
+
+    def _allocate(self, context, get_free, claim):
+        """Returns the address of the first id of get_free() that claim(id)
+        succeeds for. The lowest free address is tried first, so freed
+        addresses are reused, and the rest of the batch in random order
+        to spread allocators that lost the race for it."""
+        while True:
+            free = get_free()
+            if not free:
+                raise db.NoMoreAddresses()
+            rest = free[1:]
+            random.shuffle(rest)
+            for address_id, address in [free[0]] + rest:
+                if claim(address_id):
+                    return address
+            LOG.debug(_('Every address of a batch of %d was taken by'
+                        ' another allocator, retrying'), len(free),
+                      context=context)
+
+    def allocate_fixed_ip(self, context, network_id, instance_id):
+        """Associates a free fixed ip of network with instance_id and
+        returns its address."""
+        def get_free():
+            return self.db.fixed_ip_get_free(context, network_id,
+                                             FLAGS.ip_allocation_batch)
+
+        def claim(fixed_ip_id):
+            return self.db.fixed_ip_associate_if_free(context, fixed_ip_id,
+                                                      network_id, instance_id)
+
+        return self._allocate(context, get_free, claim)
+
+    def allocate_floating_ip(self, context, host, project_id):
+        """Allocates a free floating ip of host to project_id and returns
+        its address."""
+        def get_free():
+            return self.db.floating_ip_get_free(context, host,
+                                                FLAGS.ip_allocation_batch)
+
+        def claim(floating_ip_id):
+            return self.db.floating_ip_allocate_if_free(context,
+                                                        floating_ip_id,
+                                                        project_id)
+
+        return self._allocate(context, get_free, claim)
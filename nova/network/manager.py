@@ -57,6 +57,7 @@ from nova import log as logging
 from nova import manager
 from nova import utils
 from nova import rpc
+from nova.network import allocator
 
 
 LOG = logging.getLogger("nova.network.manager")
@@ -123,6 +124,7 @@ class NetworkManager(manager.SchedulerDependentManager):
         self.driver = utils.import_object(network_driver)
         super(NetworkManager, self).__init__(service_name='network',
                                                 *args, **kwargs)
+        self.allocator = allocator.AddressAllocator(self.db)
 
     def init_host(self):
         """Do any initialization for a standalone service."""
@@ -174,9 +176,9 @@ class NetworkManager(manager.SchedulerDependentManager):
         #             network_get_by_compute_host
         network_ref = self.db.network_get_by_bridge(context.elevated(),
                                                     FLAGS.flat_network_bridge)
-        address = self.db.fixed_ip_associate_pool(context.elevated(),
-                                                  network_ref['id'],
-                                                  instance_id)
+        address = self.allocator.allocate_fixed_ip(context.elevated(),
+                                                   network_ref['id'],
+                                                   instance_id)
         self.db.fixed_ip_update(context, address, {'allocated': True})
         return address
 
@@ -200,9 +202,9 @@ class NetworkManager(manager.SchedulerDependentManager):
     def allocate_floating_ip(self, context, project_id):
         """Gets an floating ip from the pool."""
         # TODO(vish): add floating ips through manage command
-        return self.db.floating_ip_allocate_address(context,
-                                                    self.host,
-                                                    project_id)
+        return self.allocator.allocate_floating_ip(context,
+                                                   self.host,
+                                                   project_id)
 
     def associate_floating_ip(self, context, floating_address, fixed_address):
         """Associates an floating ip to a fixed ip."""
@@ -351,15 +353,17 @@ class NetworkManager(manager.SchedulerDependentManager):
         top_reserved = self._top_reserved_ips
         project_net = IPy.IP(network_ref['cidr'])
         num_ips = len(project_net)
+        ips = []
         for index in range(num_ips):
             address = str(project_net[index])
             if index < bottom_reserved or num_ips - index < top_reserved:
                 reserved = True
             else:
                 reserved = False
-            self.db.fixed_ip_create(context, {'network_id': network_id,
-                                              'address': address,
-                                              'reserved': reserved})
+            ips.append({'network_id': network_id,
+                        'address': address,
+                        'reserved': reserved})
+        self.db.fixed_ip_bulk_create(context, ips)
 
 
 class FlatManager(NetworkManager):
@@ -512,9 +516,9 @@ class VlanManager(NetworkManager):
                                        address,
                                        instance_id)
         else:
-            address = self.db.fixed_ip_associate_pool(ctxt,
-                                                      network_ref['id'],
-                                                      instance_id)
+            address = self.allocator.allocate_fixed_ip(ctxt,
+                                                       network_ref['id'],
+                                                       instance_id)
         self.db.fixed_ip_update(context, address, {'allocated': True})
         if not FLAGS.fake_network:
             self.driver.update_dhcp(context, network_ref['id'])
@@ -24,16 +24,30 @@ No fan-out support yet.
 
 """
 
+import copy
+import itertools
 import json
 import sys
 import time
 import traceback
+import types
 import uuid
+import zlib
 
 from carrot import connection as carrot_connection
 from carrot import messaging
-from eventlet import greenpool
+from carrot import serialization
+import greenlet
 from eventlet import greenthread
+from eventlet import pools
+from eventlet import queue as eventlet_queue
+from eventlet import semaphore
+from eventlet import timeout as eventlet_timeout
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 from nova import context
 from nova import exception
@@ -47,12 +61,124 @@ LOG = logging.getLogger('nova.rpc')
 
 
 FLAGS = flags.FLAGS
-flags.DEFINE_integer('rpc_thread_pool_size', 1024, 'Size of RPC thread pool')
+flags.DEFINE_integer('rpc_thread_pool_size', 1024,
+                     'Maximum number of messages a consumer has in flight,'
+                     ' it stops fetching from the queue when saturated')
+flags.DEFINE_list('rpc_priority_methods',
+                  ['update_service_capabilities',
+                   'refresh_security_group_rules',
+                   'refresh_security_group_members'],
+                  'Methods handled in the priority lane')
+flags.DEFINE_list('rpc_bulk_methods',
+                  ['run_instance', 'run_instances', 'snapshot_instance',
+                   'prep_resize', 'resize_instance', 'live_migration'],
+                  'Methods handled in the bulk lane')
+flags.DEFINE_integer('rpc_priority_lane_size', 64,
+                     'Number of priority messages handled concurrently')
+flags.DEFINE_integer('rpc_default_lane_size', 256,
+                     'Number of messages handled concurrently that are'
+                     ' neither priority nor bulk')
+flags.DEFINE_integer('rpc_bulk_lane_size', 16,
+                     'Number of bulk messages handled concurrently')
+flags.DEFINE_integer('rpc_stream_chunk_size', 100,
+                     'Number of results sent in each reply of a call to a'
+                     ' method that returns a generator')
+flags.DEFINE_integer('rpc_stats_interval', 0,
+                     'Seconds between logging RPC timing statistics,'
+                     ' 0 to never log them')
+flags.DEFINE_integer('rpc_conn_pool_size', 30,
+                     'Size of RPC connection pool')
+flags.DEFINE_integer('rpc_response_timeout', 600,
+                     'Seconds to wait for a response from a call')
+flags.DEFINE_integer('rpc_prefetch_count', 0,
+                     'Number of unacknowledged messages the broker may push'
+                     ' to each consumer, 0 for no limit')
+flags.DEFINE_bool('rpc_local_dispatch', False,
+                  'Deliver messages for queues consumed in this process'
+                  ' directly instead of through the broker')
+flags.DEFINE_string('rpc_serializer', 'json',
+                    'Serializer for RPC messages, json or msgpack')
+flags.DEFINE_integer('rpc_compression_threshold', 0,
+                     'Compress RPC messages whose body is larger than this'
+                     ' many bytes with zlib, 0 to never compress')
+
+
+ZLIB_SUFFIX = '+zlib'
+
+
+def _msgpack_not_available(data):
+    raise serialization.SerializerNotInstalled(
+            _('No decoder installed for msgpack, install the msgpack '
+              'library'))
+
+
+def _zlib_decoder(decoder):
+    """Returns a decoder that decompresses data before decoding it."""
+
+    def _decode(data):
+        return decoder(zlib.decompress(data))
+    return _decode
+
+
+def register_serializers():
+    """Registers the RPC serializers with carrot.
+
+    Messages are decoded according to their content type, so a consumer
+    understands every registered format whatever its own rpc_serializer.
+    msgpack is registered again because carrot marks its bodies as utf-8,
+    which mangles them on decode.
+
+    """
+    registry = serialization.registry
+    if msgpack:
+        encoder, decoder = msgpack.packb, msgpack.unpackb
+    else:
+        encoder, decoder = None, _msgpack_not_available
+    registry.register('msgpack', encoder, decoder,
+                      content_type='application/x-msgpack',
+                      content_encoding='binary')
+    registry.register('msgpack' + ZLIB_SUFFIX, None, _zlib_decoder(decoder),
+                      content_type='application/x-msgpack' + ZLIB_SUFFIX,
+                      content_encoding='binary')
+    registry.register('json' + ZLIB_SUFFIX, None,
+                      _zlib_decoder(json.loads),
+                      content_type='application/json' + ZLIB_SUFFIX,
+                      content_encoding='binary')
+
+
+register_serializers()
+
+
+def serialize(data):
+    """Encodes data with FLAGS.rpc_serializer.
+
+    Returns a (content_type, content_encoding, body) tuple. Bodies larger
+    than FLAGS.rpc_compression_threshold are compressed with zlib, which
+    is recorded in the content type.
+
+    """
+    content_type, content_encoding, body = serialization.encode(
+            data, serializer=FLAGS.rpc_serializer)
+    threshold = FLAGS.rpc_compression_threshold
+    if threshold and len(body) > threshold:
+        body = zlib.compress(body)
+        content_type += ZLIB_SUFFIX
+        content_encoding = 'binary'
+    return content_type, content_encoding, body
+
+
+def deserialize(body, content_type, content_encoding):
+    """Decodes a body produced by serialize."""
+    return serialization.decode(body, content_type, content_encoding)
 
 
 class Connection(carrot_connection.BrokerConnection):
     """Connection instance object."""
 
+    def __init__(self, *args, **kwargs):
+        super(Connection, self).__init__(*args, **kwargs)
+        self.publishers = {}
+
     @classmethod
     def instance(cls, new=True):
         """Returns the instance."""
@@ -89,11 +215,73 @@ class Connection(carrot_connection.BrokerConnection):
             pass
         return cls.instance()
 
+    def get_publisher(self, publisher_cls, **kwargs):
+        """Returns a publisher of publisher_cls declared on this connection.
+
+        Publishers are cached by class and arguments, so repeated sends to
+        the same exchange and routing key reuse one channel instead of
+        declaring the exchange again for every message.
+
+        """
+        key = (publisher_cls, tuple(sorted(kwargs.iteritems())))
+        if key not in self.publishers:
+            self.publishers[key] = publisher_cls(connection=self, **kwargs)
+        return self.publishers[key]
+
+    def is_healthy(self):
+        """Checks that the broker connection has not been closed."""
+        if self._closed:
+            return False
+        # carrot connects lazily, so a connection that has not been used
+        # yet is healthy.
+        return getattr(self._connection, 'transport', True) is not None
+
+    def reset(self):
+        """Drops the cached publishers and the broker connection.
+
+        The next use of the connection transparently reconnects.
+
+        """
+        for publisher in self.publishers.values():
+            try:
+                publisher.close()
+            except Exception:  # pylint: disable=W0703
+                pass
+        self.publishers = {}
+        try:
+            self.close()
+        except Exception:  # pylint: disable=W0703
+            pass
+        self._connection = None
+        self._closed = None
+
+
+class Pool(pools.Pool):
+    """Class that implements a pool of broker connections."""
+
+    def create(self):
+        LOG.debug(_('Creating new connection'))
+        return Connection.instance(new=True)
+
+    def get(self):
+        """Returns a pooled connection, reconnecting it if it went bad."""
+        conn = super(Pool, self).get()
+        if not conn.is_healthy():
+            LOG.info(_('Pooled connection is unhealthy, reconnecting'))
+            conn.reset()
+        return conn
+
+
+# The pool is ordered as a stack so that the most recently used connections
+# are preferred and idle ones stay idle.
+ConnectionPool = Pool(max_size=FLAGS.rpc_conn_pool_size, order_as_stack=True)
+
 
 class Consumer(messaging.Consumer):
     """Consumer base class.
 
-    Contains methods for connecting the fetch method to async loops.
+    Contains methods for consuming messages in a greenthread as the broker
+    pushes them.
 
     """
 
@@ -119,18 +307,29 @@ class Consumer(messaging.Consumer):
                       FLAGS.rabbit_max_retries)
             sys.exit(1)
 
+    def declare(self):
+        """Declares the queue and applies the prefetch limit to it."""
+        super(Consumer, self).declare()
+        if FLAGS.rpc_prefetch_count:
+            self.qos(prefetch_count=FLAGS.rpc_prefetch_count)
+        return self
+
+    def reconnect(self):
+        """Recreates the connection and declares the queue again."""
+        # NOTE(vish): connection is defined in the parent class, we can
+        #             recreate it as long as we create the backend too
+        # pylint: disable=W0201
+        self.connection = Connection.recreate()
+        self.backend = self.connection.create_backend()
+        self.declare()
+
     def fetch(self, no_ack=None, auto_ack=None, enable_callbacks=False):
         """Wraps the parent fetch with some logic for failed connection."""
         # TODO(vish): the logic for failed connections and logging should be
         #             refactored into some sort of connection manager object
         try:
             if self.failed_connection:
-                # NOTE(vish): connection is defined in the parent class, we can
-                #             recreate it as long as we create the backend too
-                # pylint: disable=W0201
-                self.connection = Connection.recreate()
-                self.backend = self.connection.create_backend()
-                self.declare()
+                self.reconnect()
             super(Consumer, self).fetch(no_ack, auto_ack, enable_callbacks)
             if self.failed_connection:
                 LOG.error(_('Reconnected to queue'))
@@ -143,28 +342,190 @@ class Consumer(messaging.Consumer):
                 LOG.exception(_('Failed to fetch message from queue: %s' % e))
                 self.failed_connection = True
 
+    def consume_forever(self):
+        """Dispatches messages to the callbacks as the broker pushes them.
+
+        The connection is recreated whenever consuming fails.
+
+        """
+        while True:
+            try:
+                if self.failed_connection:
+                    self.reconnect()
+                    LOG.error(_('Reconnected to queue'))
+                    self.failed_connection = False
+                self.wait()
+            except StopIteration:
+                # The fake backend stops after every message.
+                pass
+            except Exception, e:  # pylint: disable=W0703
+                LOG.exception(_('Failed to consume message from queue: %s'),
+                              e)
+                self.failed_connection = True
+                greenthread.sleep(FLAGS.rabbit_retry_interval)
+
     def attach_to_eventlet(self):
-        """Only needed for unit tests!"""
-        timer = utils.LoopingCall(self.fetch, enable_callbacks=True)
-        timer.start(0.1)
-        return timer
+        """Starts consuming in a greenthread and returns its handle."""
+        return ConsumerThread(self)
+
+    def can_accept(self):
+        """Returns whether a message can be delivered without waiting."""
+        return True
+
+    def receive_local(self, message_data):
+        """Handles a message sent from this process, without waiting.
+
+        Returns False when it cannot be handled at once, in which case
+        the sender has to publish it through the broker instead.
+
+        """
+        self.receive(message_data, LocalMessage())
+        return True
+
+
+class ConsumerThread(object):
+    """Greenthread running Consumer.consume_forever.
+
+    Has the same stop and wait methods as utils.LoopingCall, so services can
+    treat it like their other timers.
+
+    """
+
+    def __init__(self, consumer):
+        self.consumer = consumer
+        self.thread = greenthread.spawn(consumer.consume_forever)
+        LOCAL_CONSUMERS.setdefault(consumer.queue, consumer)
+
+    def stop(self):
+        if LOCAL_CONSUMERS.get(self.consumer.queue) is self.consumer:
+            del LOCAL_CONSUMERS[self.consumer.queue]
+        self.thread.kill()
+        try:
+            self.consumer.close()
+        except Exception:  # pylint: disable=W0703
+            pass
+
+    def wait(self):
+        try:
+            return self.thread.wait()
+        except greenlet.GreenletExit:
+            return None
 
 
 class AdapterConsumer(Consumer):
-    """Calls methods on a proxy object based on method and args."""
+    """Calls methods on a proxy object based on method and args.
+
+    Messages are handled in lanes, each with its own concurrency limit, so
+    a storm of slow bulk calls cannot starve cheap priority ones.
+
+    """
 
     def __init__(self, connection=None, topic='broadcast', proxy=None):
         LOG.debug(_('Initing the Adapter Consumer for %s') % topic)
         self.proxy = proxy
-        self.pool = greenpool.GreenPool(FLAGS.rpc_thread_pool_size)
+        self.topic = topic
+        self.max_in_flight = FLAGS.rpc_thread_pool_size
+        self.in_flight = semaphore.Semaphore(self.max_in_flight)
+        self.priority_lane_size = FLAGS.rpc_priority_lane_size
+        self.lanes = {
+            'priority': semaphore.Semaphore(self.priority_lane_size),
+            'default': semaphore.Semaphore(FLAGS.rpc_default_lane_size),
+            'bulk': semaphore.Semaphore(FLAGS.rpc_bulk_lane_size)}
         super(AdapterConsumer, self).__init__(connection=connection,
                                               topic=topic)
 
-    def receive(self, *args, **kwargs):
-        self.pool.spawn_n(self._receive, *args, **kwargs)
+    def can_accept(self):
+        """Returns whether another message would be admitted at once."""
+        return not self.in_flight.locked()
+
+    def in_flight_count(self):
+        """Returns the number of admitted messages not yet handled."""
+        return (self.max_in_flight - self.in_flight.counter +
+                self.priority_lane_size - self.lanes['priority'].counter)
+
+    @staticmethod
+    def lane_for(method):
+        """Returns the name of the lane that handles method."""
+        if method in FLAGS.rpc_priority_methods:
+            return 'priority'
+        if method in FLAGS.rpc_bulk_methods:
+            return 'bulk'
+        return 'default'
+
+    def _admission(self, lane):
+        """Returns the semaphore messages of lane are admitted with.
+
+        Priority messages are admitted by their own lane, so default and
+        bulk messages holding all of rpc_thread_pool_size cannot keep
+        them out.
+
+        """
+        if lane == 'priority':
+            return self.lanes['priority']
+        return self.in_flight
+
+    def receive(self, message_data, message):
+        """Admits the message, acks it and handles it in its lane.
+
+        Admission blocks while rpc_thread_pool_size default and bulk
+        messages, or rpc_priority_lane_size priority ones, are in flight,
+        which stops the consumer fetching from the queue until a handler
+        finishes. A batch sent by cast_many is split up, and each of its
+        messages is handled with the context the batch was sent with.
+
+        """
+        for msg in self._split(message_data):
+            lane = self.lane_for(msg.get('method'))
+            self._admission(lane).acquire()
+            greenthread.spawn_n(self._dispatch, lane, msg)
+        message.ack()
+
+    def receive_local(self, message_data):
+        """Admits and handles a message sent from this process.
+
+        Unlike receive, this never blocks the sender: unless every
+        message of a batch can be admitted at once, none is, and False is
+        returned so the sender publishes the batch through the broker.
+
+        """
+        batch = self._split(message_data)
+        lanes = []
+        for msg in batch:
+            lane = self.lane_for(msg.get('method'))
+            if not self._admission(lane).acquire(blocking=False):
+                for admitted in lanes:
+                    self._admission(admitted).release()
+                return False
+            lanes.append(lane)
+        for lane, msg in zip(lanes, batch):
+            greenthread.spawn_n(self._dispatch, lane, msg)
+        return True
+
+    @staticmethod
+    def _split(message_data):
+        """Returns the messages of a cast_many batch, each with the
+        context of the batch, or message_data alone."""
+        batch = message_data.pop('_batch', None)
+        if batch is None:
+            return [message_data]
+        for msg in batch:
+            msg.update(message_data)
+        return batch
+
+    def _dispatch(self, lane, message_data):
+        """Handles an admitted message once its lane has room."""
+        admission = self._admission(lane)
+        try:
+            if admission is self.lanes[lane]:
+                self._receive(message_data)
+            else:
+                with self.lanes[lane]:
+                    self._receive(message_data)
+        finally:
+            admission.release()
 
     @exception.wrap_exception
-    def _receive(self, message_data, message):
+    def _receive(self, message_data):
         """Magically looks for a method on the proxy object and calls it.
 
         Message data should be a dictionary with two keys:
@@ -176,38 +537,67 @@ class AdapterConsumer(Consumer):
         """
         LOG.debug(_('received %s') % message_data)
         msg_id = message_data.pop('_msg_id', None)
+        reply_to = message_data.pop('_reply_to', None)
+        deadline = message_data.pop('_deadline', None)
+        sent_at = message_data.pop('_sent_at', None)
 
         ctxt = _unpack_context(message_data)
 
         method = message_data.get('method')
         args = message_data.get('args', {})
-        message.ack()
+        if sent_at:
+            STATS.record('lag', self.topic, method, time.time() - sent_at)
+        if deadline and time.time() > deadline:
+            # The caller has already given up on this call, so running
+            # it would only waste work.
+            LOG.warn(_('Dropping expired call %(msg_id)s to %(method)s'),
+                     locals())
+            return
         if not method:
-            # NOTE(vish): we may not want to ack here, but that means that bad
+            # NOTE(vish): we may not want to ack these, but that means that bad
             #             messages stay in the queue indefinitely, so for now
             #             we just log the message and send an error string
             #             back to the caller
             LOG.warn(_('no method for message: %s') % message_data)
-            msg_reply(msg_id, _('No method for message: %s') % message_data)
+            msg_reply(msg_id, _('No method for message: %s') % message_data,
+                      reply_to=reply_to)
             return
 
         node_func = getattr(self.proxy, str(method))
         node_args = dict((str(k), v) for k, v in args.iteritems())
         # NOTE(vish): magic is fun!
+        start = time.time()
         try:
             rval = node_func(context=ctxt, **node_args)
+            if isinstance(rval, types.GeneratorType):
+                if reply_to:
+                    # The generator runs as its results are sent back.
+                    _reply_stream(msg_id, rval, reply_to)
+                    STATS.record('handler', self.topic, method,
+                                 time.time() - start)
+                    return
+                rval = list(rval)
+            STATS.record('handler', self.topic, method, time.time() - start)
             if msg_id:
-                msg_reply(msg_id, rval, None)
+                msg_reply(msg_id, rval, None, reply_to=reply_to)
         except Exception as e:
+            STATS.record('handler', self.topic, method, time.time() - start)
             logging.exception('Exception during message handling')
             if msg_id:
-                msg_reply(msg_id, None, sys.exc_info())
+                msg_reply(msg_id, None, sys.exc_info(), reply_to=reply_to)
         return
 
 
 class Publisher(messaging.Publisher):
     """Publisher base class."""
-    pass
+
+    def send(self, message_data, **kwargs):
+        """Sends message_data encoded by serialize."""
+        content_type, content_encoding, body = serialize(message_data)
+        super(Publisher, self).send(body,
+                                    content_type=content_type,
+                                    content_encoding=content_encoding,
+                                    **kwargs)
 
 
 class TopicAdapterConsumer(AdapterConsumer):
@@ -282,6 +672,100 @@ class DirectConsumer(Consumer):
         super(DirectConsumer, self).__init__(connection=connection)
 
 
+class ReplyConsumer(DirectConsumer):
+    """Consumes the replies to every rpc.call made by this process.
+
+    Callers register the msg_id of their call and wait on the returned
+    ReplyWaiter. Replies carry the msg_id back, so a single long-lived
+    queue serves all concurrent calls.
+
+    """
+
+    _instance = None
+    _instance_lock = semaphore.Semaphore()
+
+    def __init__(self, connection=None):
+        self.waiters = {}
+        self.thread = None
+        super(ReplyConsumer, self).__init__(
+                connection=connection,
+                msg_id='reply_%s' % uuid.uuid4().hex)
+        self.register_callback(self._dispatch_reply)
+
+    @classmethod
+    def instance(cls):
+        """Returns the reply consumer of this process, starting it.
+
+        Declaring the queue talks to the broker and yields, so concurrent
+        first calls wait for the one creating it instead of each creating
+        their own.
+
+        """
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    reply_consumer = cls(
+                            connection=Connection.instance(new=True))
+                    reply_consumer.thread = \
+                            reply_consumer.attach_to_eventlet()
+                    cls._instance = reply_consumer
+        return cls._instance
+
+    @classmethod
+    def reset(cls):
+        """Stops the reply consumer so the next call creates a new one."""
+        reply_consumer = cls._instance
+        cls._instance = None
+        if reply_consumer:
+            reply_consumer.thread.stop()
+
+    def register(self, msg_id):
+        """Returns a ReplyWaiter that is given the replies to msg_id.
+
+        The caller unregisters it by popping msg_id from waiters.
+
+        """
+        self.waiters[msg_id] = ReplyWaiter()
+        return self.waiters[msg_id]
+
+    def _dispatch_reply(self, message_data, message):
+        message.ack()
+        msg_id = message_data.pop('_msg_id', None)
+        waiter = self.waiters.get(msg_id)
+        if not waiter:
+            LOG.warn(_('No call is waiting for reply %s'), msg_id)
+            return
+        waiter.put(message_data)
+
+
+class ReplyWaiter(object):
+    """Holds the replies to one call until the caller takes them.
+
+    Streamed replies may travel over different connections, so they are
+    numbered and handed out in sequence.
+
+    """
+
+    def __init__(self):
+        self.queue = eventlet_queue.LightQueue()
+        self.pending = {}
+        self.next_seq = 0
+
+    def put(self, data):
+        self.queue.put(data)
+
+    def get(self):
+        """Waits for and returns the next reply."""
+        while self.next_seq not in self.pending:
+            data = self.queue.get()
+            seq = data.get('_seq')
+            if seq is None:
+                return data
+            self.pending[seq] = data
+        self.next_seq += 1
+        return self.pending.pop(self.next_seq - 1)
+
+
 class DirectPublisher(Publisher):
     """Publishes messages directly on a channel specified by msg_id."""
 
@@ -294,10 +778,14 @@ class DirectPublisher(Publisher):
         super(DirectPublisher, self).__init__(connection=connection)
 
 
-def msg_reply(msg_id, reply=None, failure=None):
+def msg_reply(msg_id, reply=None, failure=None, reply_to=None, seq=None,
+              more=False):
     """Sends a reply or an error on the channel signified by msg_id.
 
-    Failure should be a sys.exc_info() tuple.
+    Failure should be a sys.exc_info() tuple. If reply_to names the
+    caller's reply queue, the reply is sent there tagged with msg_id. A
+    reply that is part of a stream is tagged with its sequence number,
+    and with more unless it is the last one.
 
     """
     if failure:
@@ -306,16 +794,62 @@ def msg_reply(msg_id, reply=None, failure=None):
         LOG.error(_("Returning exception %s to caller"), message)
         LOG.error(tb)
         failure = (failure[0].__name__, str(failure[1]), tb)
-    conn = Connection.instance()
-    publisher = DirectPublisher(connection=conn, msg_id=msg_id)
+    if reply_to:
+        msg = {'_msg_id': msg_id, 'result': reply, 'failure': failure}
+        if seq is not None:
+            msg.update({'_seq': seq, '_more': more})
+        try:
+            _send(DirectPublisher, msg, msg_id=reply_to)
+        except TypeError:
+            msg['result'] = dict((k, repr(v))
+                                 for k, v in reply.__dict__.iteritems())
+            _send(DirectPublisher, msg, msg_id=reply_to)
+        return
+    with ConnectionPool.item() as conn:
+        publisher = DirectPublisher(connection=conn, msg_id=msg_id)
+        try:
+            publisher.send({'result': reply, 'failure': failure})
+        except TypeError:
+            publisher.send(
+                    {'result': dict((k, repr(v))
+                                    for k, v in reply.__dict__.iteritems()),
+                     'failure': failure})
+        publisher.close()
+
+
+def _reply_stream(msg_id, results, reply_to):
+    """Sends the items of results back in chunks as they are generated.
+
+    Each chunk holds up to FLAGS.rpc_stream_chunk_size items. The last
+    one ends the stream, carrying the failure if results raised.
+
+    """
+    seq = 0
+    chunk = []
+    failure = None
     try:
-        publisher.send({'result': reply, 'failure': failure})
-    except TypeError:
-        publisher.send(
-                {'result': dict((k, repr(v))
-                                for k, v in reply.__dict__.iteritems()),
-                 'failure': failure})
-    publisher.close()
+        for item in results:
+            chunk.append(item)
+            if len(chunk) >= FLAGS.rpc_stream_chunk_size:
+                msg_reply(msg_id, chunk, None, reply_to, seq, more=True)
+                seq += 1
+                chunk = []
+    except Exception:
+        logging.exception('Exception while streaming results')
+        failure = sys.exc_info()
+    msg_reply(msg_id, chunk, failure, reply_to, seq)
+
+
+class Timeout(exception.Error):
+    """Signifies that a call did not get a response in time."""
+
+    def __init__(self, topic, method, timeout):
+        self.topic = topic
+        self.method = method
+        self.timeout = timeout
+        super(Timeout, self).__init__(
+                _('Timed out after %(timeout)s seconds waiting for a '
+                  'response to %(method)s on %(topic)s') % locals())
 
 
 class RemoteError(exception.Error):
@@ -365,65 +899,237 @@ def _pack_context(msg, context):
     msg.update(context)
 
 
-def call(context, topic, msg):
-    """Sends a message on a topic and wait for a response."""
+class LocalMessage(object):
+    """Stands in for a broker message delivered within the process."""
+
+    def ack(self):
+        pass
+
+
+# Consumers attached in this process, by queue name.
+LOCAL_CONSUMERS = {}
+
+
+def _send_local(queue, msg):
+    """Delivers msg to the consumer of queue in this process, if any.
+
+    The consumer is handed a copy of msg, so handling it cannot change
+    what the sender holds, and it is handled in greenthreads of the
+    consumer without blocking the sender. Returns False when the queue
+    is not consumed here or its consumer is saturated, in which case the
+    message has to go through the broker.
+
+    """
+    consumer = LOCAL_CONSUMERS.get(queue)
+    if consumer is None:
+        return False
+    return consumer.receive_local(copy.deepcopy(msg))
+
+
+class Stats(object):
+    """Histograms of RPC timings in seconds, by kind, topic and method.
+
+    The kinds are lag, from publishing a message until its handler
+    starts; handler, the time the handler ran; and round_trip, the time a
+    call waited for its reply. Lag compares clocks of different hosts, so
+    it is only as accurate as their time synchronization.
+
+    """
+
+    def __init__(self):
+        self.histograms = {}
+
+    def record(self, kind, topic, method, seconds):
+        key = (kind, topic, method)
+        if key not in self.histograms:
+            self.histograms[key] = utils.Histogram()
+        self.histograms[key].add(seconds)
+
+    def reset(self):
+        self.histograms = {}
+
+    def report(self):
+        """Returns the statistics of this process.
+
+        Timings are listed with the most total time first, followed by
+        the number of calls waiting for replies and of messages in flight
+        in each consumer.
+
+        """
+        timings = []
+        for (kind, topic, method), histogram in self.histograms.iteritems():
+            timing = histogram.to_dict()
+            timing.update({'kind': kind, 'topic': topic, 'method': method})
+            timings.append(timing)
+        timings.sort(key=lambda timing: timing['total'], reverse=True)
+        reply_consumer = getattr(ReplyConsumer, '_instance', None)
+        consumers = dict((consumer.topic, consumer.in_flight_count())
+                         for consumer in LOCAL_CONSUMERS.values()
+                         if isinstance(consumer, AdapterConsumer))
+        return {'timings': timings,
+                'calls_in_flight': len(getattr(reply_consumer, 'waiters',
+                                               {})),
+                'consumers_in_flight': consumers}
+
+
+STATS = Stats()
+
+
+def log_stats():
+    """Logs a line for each RPC timing histogram."""
+    report = STATS.report()
+    LOG.info(_('RPC calls in flight: %(calls_in_flight)d, consumers in '
+               'flight: %(consumers_in_flight)s'), report)
+    for timing in report['timings']:
+        LOG.info(_('RPC %(kind)s %(topic)s %(method)s: count=%(count)d '
+                   'mean=%(mean).4f p50=%(p50).4f p90=%(p90).4f '
+                   'p99=%(p99).4f max=%(max).4f'), timing)
+
+
+def _send(publisher_cls, msg, **kwargs):
+    """Publishes msg through a cached publisher on a pooled connection.
+
+    With FLAGS.rpc_local_dispatch, messages for topics and reply queues
+    consumed in this process skip the broker. Otherwise, if the broker
+    connection went away, the connection is reset and the message is
+    sent once more on the fresh connection.
+
+    """
+    if FLAGS.rpc_local_dispatch and publisher_cls is not FanoutPublisher:
+        queue = kwargs.get('topic') or kwargs.get('msg_id')
+        if _send_local(queue, msg):
+            return
+    # Local messages have no broker lag to measure.
+    msg['_sent_at'] = time.time()
+    with ConnectionPool.item() as conn:
+        try:
+            conn.get_publisher(publisher_cls, **kwargs).send(msg)
+        except TypeError:
+            # An unserializable message is not a connection problem.
+            raise
+        except Exception, e:  # Catching all because carrot sucks
+            LOG.warn(_('Failed to publish message, reconnecting: %s'), e)
+            conn.reset()
+            conn.get_publisher(publisher_cls, **kwargs).send(msg)
+
+
+def call(context, topic, msg, timeout=None, stream=False):
+    """Sends a message on a topic and wait for a response.
+
+    Raises Timeout if no response arrives within timeout seconds, which
+    defaults to FLAGS.rpc_response_timeout. The deadline travels with the
+    message so the receiver can skip calls that have already expired.
+
+    Methods returning a generator send their results back in chunks,
+    each of which must arrive within timeout of the previous one. The
+    results are gathered into a list, unless stream is set, in which
+    case an iterator over them is returned as soon as the first chunk
+    arrives. A streamed call to a method returning a single result
+    yields just that result.
+
+    """
     LOG.debug(_('Making asynchronous call on %s ...'), topic)
+    if timeout is None:
+        timeout = FLAGS.rpc_response_timeout
+    reply_consumer = ReplyConsumer.instance()
     msg_id = uuid.uuid4().hex
-    msg.update({'_msg_id': msg_id})
+    msg.update({'_msg_id': msg_id,
+                '_reply_to': reply_consumer.queue,
+                '_deadline': time.time() + timeout})
     LOG.debug(_('MSG_ID is %s') % (msg_id))
     _pack_context(msg, context)
 
-    class WaitMessage(object):
-        def __call__(self, data, message):
-            """Acks message and sets result."""
-            message.ack()
-            if data['failure']:
-                self.result = RemoteError(*data['failure'])
-            else:
-                self.result = data['result']
+    reply_consumer.register(msg_id)
+    start = time.time()
+    try:
+        _send(TopicPublisher, msg, topic=topic)
+    except Exception:
+        reply_consumer.waiters.pop(msg_id, None)
+        raise
+    replies = _wait_for_replies(reply_consumer, msg_id, timeout,
+                                Timeout(topic, msg.get('method'), timeout))
+    first = replies.next()
+    STATS.record('round_trip', topic, msg.get('method'),
+                 time.time() - start)
+    if '_seq' not in first:
+        replies.close()
+        # NOTE(termie): this is a little bit of a change from the original
+        #               non-eventlet code where returning a Failure
+        #               instance from a deferred call is very similar to
+        #               raising an exception
+        if first['failure']:
+            raise RemoteError(*first['failure'])
+        if stream:
+            return iter([first['result']])
+        return first['result']
+    results = _stream_results(first, replies)
+    if stream:
+        return results
+    return list(results)
+
+
+def _wait_for_replies(reply_consumer, msg_id, timeout, error):
+    """Yields the replies to msg_id in order, up to the last one.
+
+    The waiter is unregistered once the replies end or are no longer
+    wanted, so a late reply is then logged and dropped.
+
+    """
+    waiter = reply_consumer.waiters[msg_id]
+    try:
+        while True:
+            with eventlet_timeout.Timeout(timeout, error):
+                data = waiter.get()
+            yield data
+            if not data.get('_more'):
+                return
+    finally:
+        reply_consumer.waiters.pop(msg_id, None)
 
-    wait_msg = WaitMessage()
-    conn = Connection.instance()
-    consumer = DirectConsumer(connection=conn, msg_id=msg_id)
-    consumer.register_callback(wait_msg)
 
-    conn = Connection.instance()
-    publisher = TopicPublisher(connection=conn, topic=topic)
-    publisher.send(msg)
-    publisher.close()
+def _stream_results(first, replies):
+    """Yields the results held by the chunks of a streamed reply.
 
-    try:
-        consumer.wait(limit=1)
-    except StopIteration:
-        pass
-    consumer.close()
-    # NOTE(termie): this is a little bit of a change from the original
-    #               non-eventlet code where returning a Failure
-    #               instance from a deferred call is very similar to
-    #               raising an exception
-    if isinstance(wait_msg.result, Exception):
-        raise wait_msg.result
-    return wait_msg.result
+    Raises RemoteError after the results of the chunk that carries a
+    failure.
+
+    """
+    for data in itertools.chain([first], replies):
+        for item in data['result']:
+            yield item
+        if data['failure']:
+            raise RemoteError(*data['failure'])
 
 
 def cast(context, topic, msg):
     """Sends a message on a topic without waiting for a response."""
     LOG.debug(_('Making asynchronous cast on %s...'), topic)
     _pack_context(msg, context)
-    conn = Connection.instance()
-    publisher = TopicPublisher(connection=conn, topic=topic)
-    publisher.send(msg)
-    publisher.close()
+    _send(TopicPublisher, msg, topic=topic)
+
+
+def cast_many(context, topic, msgs):
+    """Sends several messages on a topic without waiting for responses.
+
+    The messages travel to the consumer in a single envelope, so a bulk
+    request costs one publish instead of one per message. They all share
+    the given context.
+
+    """
+    LOG.debug(_('Making asynchronous cast of %(count)d messages on '
+                '%(topic)s...'), {'count': len(msgs), 'topic': topic})
+    if not msgs:
+        return
+    envelope = {'_batch': msgs}
+    _pack_context(envelope, context)
+    _send(TopicPublisher, envelope, topic=topic)
 
 
 def fanout_cast(context, topic, msg):
     """Sends a message on a fanout exchange without waiting for a response."""
     LOG.debug(_('Making asynchronous fanout cast...'))
     _pack_context(msg, context)
-    conn = Connection.instance()
-    publisher = FanoutPublisher(topic, connection=conn)
-    publisher.send(msg)
-    publisher.close()
+    _send(FanoutPublisher, msg, topic=topic)
 
 
 def generic_response(message_data, message):
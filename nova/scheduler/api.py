@@ -17,6 +17,7 @@
 Handles all requests relating to schedulers.
 """
 
+import datetime
 import novaclient
 
 from nova import db
@@ -24,6 +25,8 @@ from nova import exception
 from nova import flags
 from nova import log as logging
 from nova import rpc
+from nova import utils
+from nova.scheduler import zone_clients
 
 from eventlet import greenpool
 
@@ -32,6 +35,14 @@ flags.DEFINE_bool('enable_zone_routing',
     False,
     'When True, routing to child zones will occur.')
 
+flags.DEFINE_integer('zone_location_cache_size', 10000,
+    'Number of instances whose child zone reroute_compute remembers.')
+flags.DEFINE_integer('zone_location_cache_ttl', 300,
+    'Seconds reroute_compute remembers the child zone of an instance.')
+flags.DEFINE_integer('zone_location_negative_ttl', 30,
+    'Seconds reroute_compute remembers that no child zone had an'
+    ' instance.')
+
 LOG = logging.getLogger('nova.scheduler.api')
 
 
@@ -87,15 +98,76 @@ def select(context, specs=None):
             params={"specs": specs})
 
 
-def update_service_capabilities(context, service_name, host, capabilities):
+def update_service_capabilities(context, service_name, host, capabilities,
+                                sequence=None, removed=None, full=True):
     """Send an update to all the scheduler services informing them
-       of the capabilities of this service."""
+       of the capabilities of this service. Unless full is set only
+       the changed capabilities and the names of the removed ones are
+       sent, and sequence numbers the updates of this service."""
     kwargs = dict(method='update_service_capabilities',
                   args=dict(service_name=service_name, host=host,
-                            capabilities=capabilities))
+                            capabilities=capabilities, sequence=sequence,
+                            removed=removed, full=full))
     return rpc.fanout_cast(context, 'scheduler', kwargs)
 
 
+def request_service_capabilities(context, service_name, host=None):
+    """Ask the service on host, or every service of service_name if host
+       is None, to send a full snapshot of its capabilities."""
+    kwargs = dict(method='publish_service_capabilities', args={})
+    if host is None:
+        return rpc.fanout_cast(context, service_name, kwargs)
+    return rpc.cast(context, db.queue_get_for(context, service_name, host),
+                    kwargs)
+
+
+class ZoneLocationCache(object):
+    """The child zone id of instances by instance id or name, as found by
+       the child zone fan-out of reroute_compute. A zone id of None
+       records that no child zone had the instance. Entries expire after
+       zone_location_cache_ttl, or zone_location_negative_ttl for the
+       instances no child zone had, and only the zone_location_cache_size
+       most recently used are kept."""
+    def __init__(self):
+        self.entries = None
+
+    def _entries(self):
+        if self.entries is None:
+            self.entries = utils.LRUCache(FLAGS.zone_location_cache_size)
+        return self.entries
+
+    def clear(self):
+        self.entries = None
+
+    def get(self, item_id):
+        """Return (True, zone id) if item_id is cached, (False, None)
+           otherwise."""
+        entry = self._entries().get(str(item_id))
+        if entry is None:
+            return False, None
+        expires_at, zone_id = entry
+        if utils.utcnow() >= expires_at:
+            self.invalidate(item_id)
+            return False, None
+        return True, zone_id
+
+    def set(self, item_id, zone_id):
+        if zone_id is None:
+            ttl = FLAGS.zone_location_negative_ttl
+        else:
+            ttl = FLAGS.zone_location_cache_ttl
+        if ttl <= 0:
+            return
+        expires_at = utils.utcnow() + datetime.timedelta(seconds=ttl)
+        self._entries().set(str(item_id), (expires_at, zone_id))
+
+    def invalidate(self, item_id):
+        self._entries().pop(str(item_id))
+
+
+ZONE_LOCATIONS = ZoneLocationCache()
+
+
 def _wrap_method(function, self):
     """Wrap method to supply self."""
     def _wrap(*args, **kwargs):
@@ -106,9 +178,10 @@ def _wrap_method(function, self):
 def _process(func, zone):
     """Worker stub for green thread pool. Give the worker
     an authenticated nova client and zone info."""
-    nova = novaclient.OpenStack(zone.username, zone.password, zone.api_url)
-    nova.authenticate()
-    return func(nova, zone)
+    return zone_clients.call(zone, func, zone)
+
+
+_FAILED = object()
 
 
 def call_zone_method(context, method, errors_to_ignore=None, *args, **kwargs):
@@ -117,37 +190,36 @@ def call_zone_method(context, method, errors_to_ignore=None, *args, **kwargs):
         # This will also handle the default None
         errors_to_ignore = [errors_to_ignore]
 
-    pool = greenpool.GreenPool()
-    results = []
-    for zone in db.zone_get_all(context):
+    def _error_trap(nova, *args, **kwargs):
+        zone_method = getattr(nova.zones, method)
+        try:
+            return zone_method(*args, **kwargs)
+        except Exception as e:
+            if type(e) in errors_to_ignore:
+                return None
+            # TODO (dabo) - want to be able to re-raise here.
+            # Returning a string now; raising was causing issues.
+            # raise e
+            return "ERROR", "%s" % e
+
+    def _call_zone(zone):
         try:
-            nova = novaclient.OpenStack(zone.username, zone.password,
-                    zone.api_url)
-            nova.authenticate()
+            return zone_clients.call(zone, _error_trap, *args, **kwargs)
         except novaclient.exceptions.BadRequest, e:
             url = zone.api_url
             LOG.warn(_("Failed request to zone; URL=%(url)s: %(e)s")
                     % locals())
             #TODO (dabo) - add logic for failure counts per zone,
             # with escalation after a given number of failures.
-            continue
-        zone_method = getattr(nova.zones, method)
+            return _FAILED
 
-        def _error_trap(*args, **kwargs):
-            try:
-                return zone_method(*args, **kwargs)
-            except Exception as e:
-                if type(e) in errors_to_ignore:
-                    return None
-                # TODO (dabo) - want to be able to re-raise here.
-                # Returning a string now; raising was causing issues.
-                # raise e
-                return "ERROR", "%s" % e
-
-        res = pool.spawn(_error_trap, *args, **kwargs)
-        results.append((zone, res))
+    pool = greenpool.GreenPool()
+    results = [(zone, pool.spawn(_call_zone, zone))
+               for zone in db.zone_get_all(context)]
     pool.waitall()
-    return [(zone.id, res.wait()) for zone, res in results]
+    results = [(zone.id, res.wait()) for zone, res in results]
+    return [(zone_id, result) for zone_id, result in results
+            if result is not _FAILED]
 
 
 def child_zone_helper(zone_list, func):
@@ -176,6 +248,7 @@ def _issue_novaclient_command(nova, zone, collection, method_name, item_id):
         LOG.debug(_("%(collection)s '%(item_id)s' not found on '%(url)s'" %
                                                 locals()))
         return None
+    ZONE_LOCATIONS.set(item_id, zone.id)
 
     if method_name.lower() not in ['get', 'find']:
         result = getattr(result, method_name)()
@@ -226,15 +299,41 @@ class reroute_compute(object):
                     raise
 
                 # Ask the children to provide an answer ...
-                LOG.debug(_("Asking child zones ..."))
-                result = self._call_child_zones(zones,
+                result = self._call_located_zones(zones,
                             wrap_novaclient_function(_issue_novaclient_command,
-                                   collection, self.method_name, item_id))
+                                   collection, self.method_name, item_id),
+                            item_id)
+                if self.method_name == 'delete':
+                    ZONE_LOCATIONS.invalidate(item_id)
                 # Scrub the results and raise another exception
                 # so the API layers can bail out gracefully ...
                 raise RedirectResult(self.unmarshall_result(result))
         return wrapped_f
 
+    def _call_located_zones(self, zones, function, item_id):
+        """Ask the child zone item_id was last found in, if it is cached,
+        and every child zone otherwise. _issue_novaclient_command caches
+        the zone that has item_id."""
+        cached, zone_id = ZONE_LOCATIONS.get(item_id)
+        if cached and zone_id is None:
+            LOG.debug(_("No child zone had %(item_id)s recently") % locals())
+            return []
+        if cached:
+            located = [zone for zone in zones if zone.id == zone_id]
+            if located:
+                LOG.debug(_("Asking child zone %(zone_id)s ...") % locals())
+                ZONE_LOCATIONS.invalidate(item_id)
+                result = self._call_child_zones(located, function)
+                if ZONE_LOCATIONS.get(item_id)[0]:
+                    return result
+
+        LOG.debug(_("Asking child zones ..."))
+        ZONE_LOCATIONS.invalidate(item_id)
+        result = self._call_child_zones(zones, function)
+        if not ZONE_LOCATIONS.get(item_id)[0]:
+            ZONE_LOCATIONS.set(item_id, None)
+        return result
+
     def _call_child_zones(self, zones, function):
         """Ask the child zones to perform this operation.
         Broken out for testing."""
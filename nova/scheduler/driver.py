@@ -72,6 +72,10 @@ class Scheduler(object):
                 for service in services
                 if self.service_is_up(service)]
 
+    def periodic_tasks(self, context):
+        """Tasks to be run at a periodic interval."""
+        pass
+
     def schedule(self, context, topic, *_args, **_kwargs):
         """Must override at least this method for scheduler to work."""
         raise NotImplementedError(_("Must implement a fallback schedule"))
@@ -42,6 +42,7 @@ from nova import exception
 from nova import flags
 from nova import log as logging
 from nova import utils
+from nova.scheduler import host_table
 
 LOG = logging.getLogger('nova.scheduler.host_filter')
 
@@ -93,6 +94,12 @@ class FlavorFilter(HostFilter):
     def filter_hosts(self, zone_manager, query):
         """Return a list of hosts that can create instance_type."""
         instance_type = query
+        index = _capacity_index(zone_manager)
+        if index:
+            hosts = index.hosts_with(instance_type['memory_mb'],
+                                     instance_type['local_gb'])
+            return [(host, zone_manager.service_states[host]['compute'])
+                    for host in hosts]
         selected_hosts = []
         for host, services in zone_manager.service_states.iteritems():
             capabilities = services.get('compute', {})
@@ -130,9 +137,101 @@ class FlavorFilter(HostFilter):
 #rxtx_cap = Column(Integer, nullable=False, default=0)
 
 
+def _host_table(zone_manager):
+    """Return the HostTable of zone_manager if it covers every host."""
+    table = getattr(zone_manager, 'host_table', None)
+    if table is None or not table.enabled or \
+            len(table) != len(zone_manager.service_states):
+        return None
+    return table
+
+
+def _capacity_index(zone_manager):
+    """Return the HostCapacityIndex of zone_manager if it can answer
+    for every host."""
+    index = getattr(zone_manager, 'capacity_index', None)
+    if index is None or index.impure or \
+            len(index) != len(zone_manager.service_states):
+        return None
+    return index
+
+
+def _constant(value):
+    """Returns a function of the services of a host that returns value."""
+    return lambda services: value
+
+
+def _capability_getter(path):
+    """Returns a function that looks up the capability path in the
+    services of a host, like JsonFilter._parse_string."""
+    def _get(services):
+        for item in path:
+            services = services.get(item, None)
+            if not services:
+                return None
+        return services
+    return _get
+
+
+def _is_number(value):
+    return isinstance(value, (int, long, float)) and \
+           not isinstance(value, bool)
+
+
+def _vector_comparison(cmd, column, constants):
+    """Returns a function of a HostTable that compares the column with
+    constants for every row, like the matching JsonFilter command."""
+    numpy = host_table.numpy
+
+    def _mask(table):
+        values = table.column(column)
+        if values is None:
+            return None
+        with numpy.errstate(invalid='ignore'):
+            # Lookups of missing or zero capabilities are dropped from
+            # the arguments, like _parse_string does.
+            valid = ~numpy.isnan(values) & (values != 0)
+            if cmd == 'in':
+                return numpy.where(valid,
+                                   numpy.in1d(values, constants),
+                                   constants[0] in constants[1:])
+            ufunc = {'=': numpy.equal,
+                     '<': numpy.less,
+                     '>': numpy.greater,
+                     '<=': numpy.less_equal,
+                     '>=': numpy.greater_equal}[cmd]
+            return valid & ufunc(values, constants[0])
+    return _mask
+
+
+def _vector_reduction(subs, reduce, negate=False):
+    """Returns a function of a HostTable that combines the masks of
+    subs, negating them first if asked to."""
+    def _mask(table):
+        result = None
+        for sub in subs:
+            mask = sub(table)
+            if mask is None:
+                return None
+            if negate:
+                mask = ~mask
+            result = mask if result is None else reduce(result, mask)
+        return result
+    return _mask
+
+
 class JsonFilter(HostFilter):
     """Host Filter driver to allow simple JSON-based grammar for
-       selecting hosts."""
+       selecting hosts.
+
+       Queries are compiled into a tree of closures once and kept in
+       an LRU cache, so filtering many hosts does not interpret the
+       query again for each of them. When the ZoneManager keeps a
+       HostTable, queries over its numeric columns are evaluated as
+       array operations over all hosts at once."""
+
+    compiled_queries = utils.LRUCache(256)
+    compiled_vector_queries = utils.LRUCache(256)
 
     def _equals(self, args):
         """First term is == all the other terms."""
@@ -258,12 +357,141 @@ class JsonFilter(HostFilter):
         result = method(self, cooked_args)
         return result
 
+    # Return what the matching commands return for two arguments, so
+    # comparisons of a capability with a constant can skip building the
+    # argument list.
+    comparisons = {
+        '=': lambda lhs, rhs: not lhs != rhs,
+        '<': lambda lhs, rhs: not lhs >= rhs,
+        '>': lambda lhs, rhs: not lhs <= rhs,
+        '<=': lambda lhs, rhs: not lhs > rhs,
+        '>=': lambda lhs, rhs: not lhs < rhs,
+    }
+
+    def _compile_filter(self, query):
+        """Compile the query structure into a function of the services
+        of a host, which returns what _process_filter would."""
+        if len(query) == 0:
+            return _constant(True)
+        cmd = query[0]
+        method = self.commands[cmd]  # Let exception fly.
+        args = []
+        for arg in query[1:]:
+            if isinstance(arg, list):
+                args.append(('filter', self._compile_filter(arg)))
+            elif isinstance(arg, basestring):
+                if arg.startswith('$'):
+                    args.append(('capability',
+                                 _capability_getter(arg[1:].split('.'))))
+                elif arg:
+                    args.append(('constant', _constant(arg)))
+            elif arg != None:
+                args.append(('constant', _constant(arg)))
+        kinds = [kind for kind, getter in args]
+        getters = [getter for kind, getter in args]
+
+        if cmd in self.comparisons and kinds == ['capability', 'constant']:
+            compare = self.comparisons[cmd]
+            get_lhs = getters[0]
+            rhs = getters[1](None)
+
+            def _compare(services):
+                lhs = get_lhs(services)
+                if lhs == None:
+                    return False
+                return compare(lhs, rhs)
+            return _compare
+
+        if cmd == 'and' and set(kinds) <= set(['filter']):
+
+            def _and(services):
+                for getter in getters:
+                    if getter(services) == False:
+                        return False
+                return True
+            return _and
+
+        if cmd == 'or' and set(kinds) <= set(['filter']):
+
+            def _or(services):
+                for getter in getters:
+                    if getter(services) == True:
+                        return True
+                return False
+            return _or
+
+        def _filter(services):
+            cooked_args = []
+            for getter in getters:
+                arg = getter(services)
+                if arg != None:
+                    cooked_args.append(arg)
+            return method(self, cooked_args)
+        return _filter
+
+    def _compile_vector(self, query, top=True):
+        """Compile the query structure into a function of a HostTable
+        returning a boolean mask of the rows that pass, or None if a
+        column it needs cannot be used. Returns None for queries that
+        can only be evaluated per host.
+
+        Only the top level of a query may be a 'not', since elsewhere
+        its result is a list that and/or treat differently."""
+        if not isinstance(query, list) or len(query) < 2:
+            return None
+        cmd, args = query[0], query[1:]
+        if cmd in self.comparisons or cmd == 'in':
+            lhs = args[0]
+            if not isinstance(lhs, basestring) or not lhs.startswith('$'):
+                return None
+            constants = [arg for arg in args[1:] if arg != None and arg != '']
+            if not constants or not all(map(_is_number, constants)):
+                return None
+            if cmd != 'in' and len(constants) != 1:
+                return None
+            return _vector_comparison(cmd, lhs[1:], constants)
+        if cmd in ('and', 'or') or (cmd == 'not' and top):
+            subs = [self._compile_vector(arg, False) for arg in args]
+            if None in subs:
+                return None
+            if cmd == 'and':
+                return _vector_reduction(subs, host_table.numpy.logical_and)
+            return _vector_reduction(subs, host_table.numpy.logical_or,
+                                     negate=(cmd == 'not'))
+        return None
+
+    def compile_vector(self, query):
+        """Return the vector form of a JSON query string, or None if it
+        has none, compiling it only if it is not cached yet."""
+        key = (self.__class__, query)
+        if key not in self.compiled_vector_queries:
+            self.compiled_vector_queries.set(
+                    key, self._compile_vector(json.loads(query)))
+        return self.compiled_vector_queries.get(key)
+
+    def compile(self, query):
+        """Return the compiled form of a JSON query string, compiling
+        it only if it is not cached yet."""
+        key = (self.__class__, query)
+        compiled = self.compiled_queries.get(key)
+        if compiled is None:
+            compiled = self._compile_filter(json.loads(query))
+            self.compiled_queries.set(key, compiled)
+        return compiled
+
     def filter_hosts(self, zone_manager, query):
         """Return a list of hosts that can fulfill filter."""
-        expanded = json.loads(query)
+        table = _host_table(zone_manager)
+        if table:
+            vector = self.compile_vector(query)
+            mask = vector and vector(table)
+            if mask is not None:
+                return [(host, zone_manager.service_states[host])
+                        for host in table.hosts_for(mask)]
+        compiled = self.compile(query)
         hosts = []
         for host, services in zone_manager.service_states.iteritems():
-            r = self._process_filter(zone_manager, expanded, host, services)
+            r = compiled(services)
             if isinstance(r, list):
                 r = True in r
             if r:
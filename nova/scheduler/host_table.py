@@ -0,0 +1,126 @@
+# Copyright (c) 2011 Openstack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+HostTable keeps a columnar copy of the numeric host capabilities known
+to the ZoneManager, so host filters can be evaluated over every host at
+once as NumPy array operations instead of a walk over nested dicts per
+host.
+
+NumPy is optional. Without it the table stays empty and the filters use
+their per-host code.
+"""
+
+from nova import flags
+from nova import log as logging
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+LOG = logging.getLogger('nova.scheduler.host_table')
+
+FLAGS = flags.FLAGS
+flags.DEFINE_list('host_table_capabilities',
+                  ['compute.host_memory_total',
+                   'compute.host_memory_free',
+                   'compute.disk_total',
+                   'compute.disk_available',
+                   'compute.disk_used',
+                   'compute.vcpus',
+                   'compute.vcpus_used'],
+                  'Numeric capabilities, as service.capability paths,'
+                  ' that the scheduler keeps in columns for vectorized'
+                  ' filtering')
+
+
+def _lookup(capabilities, path):
+    for item in path:
+        if not isinstance(capabilities, dict):
+            return None
+        capabilities = capabilities.get(item)
+    return capabilities
+
+
+class HostTable(object):
+    """One row per host and one array per capability path.
+
+    Missing values are NaN. Hosts reporting a value that is not a
+    number make its column impure, and callers should then fall back
+    to the capability dicts for queries on that column.
+
+    """
+
+    def __init__(self, columns=None):
+        self.enabled = numpy is not None
+        self.columns = columns or FLAGS.host_table_capabilities
+        self.hosts = []
+        self.rows = {}
+        self.data = {}
+        self.impure = {}
+        for column in self.columns:
+            self.impure[column] = set()
+            if self.enabled:
+                self.data[column] = numpy.empty(0)
+
+    def __len__(self):
+        return len(self.hosts)
+
+    def _add_row(self, host):
+        row = len(self.hosts)
+        capacity = len(self.data[self.columns[0]]) if self.columns else 0
+        if row >= capacity:
+            grow = max(capacity, 16)
+            for column in self.columns:
+                self.data[column] = numpy.concatenate(
+                        [self.data[column], numpy.empty(grow) * numpy.nan])
+        self.hosts.append(host)
+        self.rows[host] = row
+        return row
+
+    def update(self, host, service_name, capabilities):
+        """Copies the tracked capabilities of a service on host."""
+        if not self.enabled:
+            return
+        row = self.rows.get(host)
+        if row is None:
+            row = self._add_row(host)
+        for column in self.columns:
+            path = column.split('.')
+            if path[0] != service_name:
+                continue
+            value = _lookup(capabilities, path[1:])
+            if isinstance(value, (int, long, float)):
+                self.data[column][row] = value
+                self.impure[column].discard(host)
+            else:
+                self.data[column][row] = numpy.nan
+                if value is None:
+                    self.impure[column].discard(host)
+                else:
+                    self.impure[column].add(host)
+
+    def column(self, column):
+        """Returns the values of a column, one per row, or None if the
+        column is not tracked or holds values that are not numbers."""
+        if not self.enabled or column not in self.data or \
+                self.impure[column]:
+            return None
+        return self.data[column][:len(self.hosts)]
+
+    def hosts_for(self, mask):
+        """Returns the names of the hosts whose rows are set in mask."""
+        return [self.hosts[row] for row in numpy.flatnonzero(mask)]
@@ -23,12 +23,15 @@ Scheduler Service
 
 import functools
 
+from nova import context
 from nova import db
 from nova import flags
 from nova import log as logging
 from nova import manager
 from nova import rpc
 from nova import utils
+from nova.compute import power_state
+from nova.scheduler import api
 from nova.scheduler import zone_manager
 
 LOG = logging.getLogger('nova.scheduler.manager')
@@ -55,6 +58,7 @@ class SchedulerManager(manager.Manager):
     def periodic_tasks(self, context=None):
         """Poll child zones periodically to get status."""
         self.zone_manager.ping(context)
+        self.driver.periodic_tasks(context)
 
     def get_zone_list(self, context=None):
         """Get a list of zones from the ZoneManager."""
@@ -64,13 +68,93 @@ class SchedulerManager(manager.Manager):
         """Get the normalized set of capabilites for this zone."""
         return self.zone_manager.get_zone_capabilities(context)
 
+    def init_host(self):
+        """Ask every service for a full snapshot of its capabilities."""
+        ctxt = context.get_admin_context()
+        for topic in (FLAGS.compute_topic, FLAGS.network_topic):
+            api.request_service_capabilities(ctxt, topic)
+
     def update_service_capabilities(self, context=None, service_name=None,
-                                                host=None, capabilities={}):
+                                    host=None, capabilities={},
+                                    sequence=None, removed=None, full=True):
         """Process a capability update from a service node."""
-        self.zone_manager.update_service_capabilities(service_name,
-                            host, capabilities)
-
-    def _schedule(self, method, context, topic, *args, **kwargs):
+        applied = self.zone_manager.update_service_capabilities(service_name,
+                            host, capabilities, sequence=sequence,
+                            removed=removed, full=full)
+        if not applied:
+            api.request_service_capabilities(context, service_name, host)
+
+    def run_instances(self, context, topic, instance_ids, **kwargs):
+        """Schedules a run_instance request for each of instance_ids.
+
+        The requests for instances placed on the same host are sent to it
+        in a single rpc.cast_many. Instances that could not be placed are
+        set to the failed state, so they do not wait for a host forever.
+        Drivers that provision an instance themselves, like the
+        ZoneAwareScheduler, place it on no host and nothing is cast.
+        """
+        hosts = self._schedule_run_instances(context, topic, instance_ids,
+                                             **kwargs)
+        msgs_by_host = {}
+        for instance_id in instance_ids:
+            if instance_id not in hosts:
+                db.instance_set_state(context, instance_id,
+                                      power_state.FAILED, 'error')
+                continue
+            host = hosts[instance_id]
+            if host is None:
+                continue
+            args = dict(kwargs, instance_id=instance_id)
+            msgs_by_host.setdefault(host, []).append(
+                    {"method": "run_instance", "args": args})
+
+        for host, msgs in msgs_by_host.iteritems():
+            rpc.cast_many(context, db.queue_get_for(context, topic, host),
+                          msgs)
+            LOG.debug(_("Casting to %(topic)s %(host)s for %(count)d "
+                        "run_instance requests"),
+                      {'topic': topic, 'host': host, 'count': len(msgs)})
+
+    def _schedule_run_instances(self, context, topic, instance_ids,
+                                **kwargs):
+        """Returns a dict of instance id to host for instance_ids.
+
+        Uses the driver's schedule_run_instances to place them all at
+        once if it has one, and schedules them one at a time otherwise.
+        Instances the driver provisioned itself map to None. Instances
+        that could not be placed are logged and left out.
+        """
+        schedule_many = getattr(self.driver, 'schedule_run_instances', None)
+        if schedule_many:
+            try:
+                return schedule_many(context.elevated(), instance_ids,
+                                     topic=topic, **kwargs)
+            except Exception:
+                LOG.exception(_("Failed to schedule instances %s"),
+                              instance_ids)
+                return self._placed_hosts(context, instance_ids)
+
+        hosts = {}
+        for instance_id in instance_ids:
+            try:
+                hosts[instance_id] = self._schedule_host('run_instance',
+                        context, topic, instance_id=instance_id, **kwargs)
+            except Exception:
+                LOG.exception(_("Failed to schedule instance %s"),
+                              instance_id)
+        return hosts
+
+    def _placed_hosts(self, context, instance_ids):
+        """Returns a dict of instance id to host for the instances of
+        instance_ids the driver placed before it failed."""
+        hosts = {}
+        for instance_id in instance_ids:
+            host = db.instance_get(context, instance_id)['host']
+            if host:
+                hosts[instance_id] = host
+        return hosts
+
+    def _schedule_host(self, method, context, topic, *args, **kwargs):
         """Tries to call schedule_* method on the driver to retrieve host.
 
         Falls back to schedule(context, topic) if method doesn't exist.
@@ -82,7 +166,11 @@ class SchedulerManager(manager.Manager):
                                                        **kwargs)
         except AttributeError:
             host = self.driver.schedule(elevated, topic, *args, **kwargs)
+        return host
 
+    def _schedule(self, method, context, topic, *args, **kwargs):
+        """Retrieves a host from the driver and casts method to it."""
+        host = self._schedule_host(method, context, topic, *args, **kwargs)
         rpc.cast(context,
                  db.queue_get_for(context, topic, host),
                  {"method": method,
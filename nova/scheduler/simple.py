@@ -22,12 +22,16 @@ Simple Scheduler
 """
 
 import datetime
+import heapq
 
 from nova import db
 from nova import flags
+from nova import log as logging
+from nova import utils
 from nova.scheduler import driver
 from nova.scheduler import chance
 
+LOG = logging.getLogger('nova.scheduler.simple')
 FLAGS = flags.FLAGS
 flags.DEFINE_integer("max_cores", 16,
                      "maximum number of instance cores to allow per host")
@@ -37,9 +41,100 @@ flags.DEFINE_integer("max_networks", 1000,
                      "maximum number of networks to allow per host")
 
 
+flags.DEFINE_integer("host_usage_reconcile_interval", 60,
+                     "seconds between reading the usage of every host from"
+                     " the db again, 0 to read it for every request")
+
+
+class HostUsage(object):
+    """Usage of one resource by host, kept between scheduling requests.
+
+    Seeded from the service_get_all_<topic>_sorted aggregate in the db,
+    bumped for each placement of the scheduler and read again from the
+    db once it is older than host_usage_reconcile_interval, to pick up
+    usage that changed without the scheduler. As deleted and moved
+    instances are only noticed then, the scheduler also reads it again
+    before it gives up on hosts that look saturated.
+    """
+
+    def __init__(self, topic):
+        self.topic = topic
+        self.usage = {}
+        self.reconciled_at = None
+
+    def is_stale(self):
+        if self.reconciled_at is None:
+            return True
+        interval = datetime.timedelta(
+                seconds=FLAGS.host_usage_reconcile_interval)
+        return utils.utcnow() - self.reconciled_at >= interval
+
+    def reconcile(self, context):
+        """Read the usage of every host from the db."""
+        load = getattr(db, 'service_get_all_%s_sorted' % self.topic)
+        results = load(context)
+        self.usage = dict((service['host'], usage)
+                          for service, usage in results)
+        self.reconciled_at = utils.utcnow()
+        return results
+
+    def add(self, host, amount):
+        self.usage[host] = self.usage.get(host, 0) + amount
+
+    def sorted_services(self, context):
+        """Return (service, usage) for the enabled services of topic,
+        least used first, as service_get_all_<topic>_sorted does."""
+        if self.is_stale():
+            return self.reconcile(context)
+        services = db.service_get_all_by_topic(context, self.topic)
+        results = [(service, self.usage.get(service['host'], 0))
+                   for service in services]
+        results.sort(key=lambda result: result[1])
+        return results
+
+
 class SimpleScheduler(chance.ChanceScheduler):
     """Implements Naive Scheduler that tries to find least loaded host."""
 
+    def __init__(self):
+        super(SimpleScheduler, self).__init__()
+        self.usage = {'compute': HostUsage('compute'),
+                      'volume': HostUsage('volume'),
+                      'network': HostUsage('network')}
+
+    def periodic_tasks(self, context):
+        """Reconcile the usage of every host with the db."""
+        for usage in self.usage.itervalues():
+            if usage.is_stale():
+                usage.reconcile(context)
+
+    def _least_used_host(self, context, topic, amount, limit, saturated):
+        """Returns the up host of topic with the least usage, unless
+        adding amount to it would go over limit.
+
+        Raises NoValidHost with the message saturated when every host is
+        over limit, after reading the usage from the db again if it was
+        not just read, so hosts freed since the last reconcile are found.
+        """
+        usage = self.usage[topic]
+        reconciled = usage.is_stale()
+        results = usage.sorted_services(context)
+        while True:
+            for service, used in results:
+                if used + amount > limit:
+                    break
+                if self.service_is_up(service):
+                    return service['host']
+            else:
+                raise driver.NoValidHost(_("Scheduler was unable to locate"
+                                           " a host for this request. Is"
+                                           " the appropriate service"
+                                           " running?"))
+            if reconciled:
+                raise driver.NoValidHost(saturated)
+            results = usage.reconcile(context)
+            reconciled = True
+
     def schedule_run_instance(self, context, instance_id, *_args, **_kwargs):
         """Picks a host that is up and has the fewest running instances."""
         instance_ref = db.instance_get(context, instance_id)
@@ -57,24 +152,100 @@ class SimpleScheduler(chance.ChanceScheduler):
             now = datetime.datetime.utcnow()
             db.instance_update(context, instance_id, {'host': host,
                                                       'scheduled_at': now})
+            self.usage['compute'].add(host, instance_ref['vcpus'])
             return host
-        results = db.service_get_all_compute_sorted(context)
-        for result in results:
-            (service, instance_cores) = result
+        host = self._least_used_host(context, 'compute',
+                                     instance_ref['vcpus'], FLAGS.max_cores,
+                                     _("All hosts have too many cores"))
+        # NOTE(vish): this probably belongs in the manager, if we
+        #             can generalize this somehow
+        now = datetime.datetime.utcnow()
+        db.instance_update(context, instance_id, {'host': host,
+                                                  'scheduled_at': now})
+        self.usage['compute'].add(host, instance_ref['vcpus'])
+        return host
+
+    def _compute_load(self, results, placed_cores):
+        """Returns a heap of (cores, position, host) for the up hosts of
+        results, counting placed_cores not yet in the usage."""
+        # NOTE(vish): the position in the sorted results breaks ties, so
+        #             equally loaded hosts are used in the same order
+        #             schedule_run_instance would use them.
+        load = [(instance_cores + placed_cores.get(service['host'], 0),
+                 position, service['host'])
+                for position, (service, instance_cores) in enumerate(results)
+                if self.service_is_up(service)]
+        heapq.heapify(load)
+        return load
+
+    def schedule_run_instances(self, context, instance_ids, *_args,
+                               **_kwargs):
+        """Picks hosts for all of instance_ids in a single pass.
+
+        Instances asking for a specific host go there as in
+        schedule_run_instance. The rest start from the usage of every
+        host, and each instance goes to the host with the fewest cores
+        counting the ones placed before it, and the placements are
+        written in one transaction. Returns a dict of instance id to
+        host without the instances that could not be placed.
+
+        """
+        hosts = {}
+        instance_refs = []
+        for instance_id in instance_ids:
+            instance_ref = db.instance_get(context, instance_id)
+            if (instance_ref['availability_zone']
+                and ':' in instance_ref['availability_zone']
+                and context.is_admin):
+                try:
+                    hosts[instance_id] = self.schedule_run_instance(
+                            context, instance_id)
+                except driver.WillNotSchedule, e:
+                    LOG.error(_("Failed to schedule instance %(instance_id)s:"
+                                " %(e)s") % locals())
+            else:
+                instance_refs.append(instance_ref)
+        if not instance_refs:
+            return hosts
+
+        usage = self.usage['compute']
+        reconciled = usage.is_stale()
+        placed = {}
+        placed_cores = {}
+        load = self._compute_load(usage.sorted_services(context),
+                                  placed_cores)
+        for instance_ref in instance_refs:
+            if (load and not reconciled and
+                load[0][0] + instance_ref['vcpus'] > FLAGS.max_cores):
+                # Instances deleted or moved since the last reconcile may
+                # have made room.
+                load = self._compute_load(usage.reconcile(context),
+                                          placed_cores)
+                reconciled = True
+            if not load:
+                LOG.error(_("Failed to schedule instance %s: no compute"
+                            " host is up"), instance_ref['id'])
+                continue
+            instance_cores, position, host = load[0]
             if instance_cores + instance_ref['vcpus'] > FLAGS.max_cores:
-                raise driver.NoValidHost(_("All hosts have too many cores"))
-            if self.service_is_up(service):
-                # NOTE(vish): this probably belongs in the manager, if we
-                #             can generalize this somehow
-                now = datetime.datetime.utcnow()
-                db.instance_update(context,
-                                   instance_id,
-                                   {'host': service['host'],
-                                    'scheduled_at': now})
-                return service['host']
-        raise driver.NoValidHost(_("Scheduler was unable to locate a host"
-                                   " for this request. Is the appropriate"
-                                   " service running?"))
+                LOG.error(_("Failed to schedule instance %s: all hosts have"
+                            " too many cores"), instance_ref['id'])
+                continue
+            heapq.heapreplace(load, (instance_cores + instance_ref['vcpus'],
+                                     position, host))
+            placed[instance_ref['id']] = host
+            placed_cores[host] = (placed_cores.get(host, 0) +
+                                  instance_ref['vcpus'])
+        # NOTE(vish): this probably belongs in the manager, if we
+        #             can generalize this somehow
+        now = datetime.datetime.utcnow()
+        db.instance_update_hosts(context, placed, {'scheduled_at': now})
+        for instance_ref in instance_refs:
+            if instance_ref['id'] in placed:
+                self.usage['compute'].add(placed[instance_ref['id']],
+                                          instance_ref['vcpus'])
+        hosts.update(placed)
+        return hosts
 
     def schedule_create_volume(self, context, volume_id, *_args, **_kwargs):
         """Picks a host that is up and has the fewest volumes."""
@@ -93,36 +264,24 @@ class SimpleScheduler(chance.ChanceScheduler):
             now = datetime.datetime.utcnow()
             db.volume_update(context, volume_id, {'host': host,
                                                   'scheduled_at': now})
+            self.usage['volume'].add(host, volume_ref['size'])
             return host
-        results = db.service_get_all_volume_sorted(context)
-        for result in results:
-            (service, volume_gigabytes) = result
-            if volume_gigabytes + volume_ref['size'] > FLAGS.max_gigabytes:
-                raise driver.NoValidHost(_("All hosts have too many "
-                                           "gigabytes"))
-            if self.service_is_up(service):
-                # NOTE(vish): this probably belongs in the manager, if we
-                #             can generalize this somehow
-                now = datetime.datetime.utcnow()
-                db.volume_update(context,
-                                 volume_id,
-                                 {'host': service['host'],
-                                  'scheduled_at': now})
-                return service['host']
-        raise driver.NoValidHost(_("Scheduler was unable to locate a host"
-                                   " for this request. Is the appropriate"
-                                   " service running?"))
+        host = self._least_used_host(context, 'volume', volume_ref['size'],
+                                     FLAGS.max_gigabytes,
+                                     _("All hosts have too many gigabytes"))
+        # NOTE(vish): this probably belongs in the manager, if we
+        #             can generalize this somehow
+        now = datetime.datetime.utcnow()
+        db.volume_update(context, volume_id, {'host': host,
+                                              'scheduled_at': now})
+        self.usage['volume'].add(host, volume_ref['size'])
+        return host
 
     def schedule_set_network_host(self, context, *_args, **_kwargs):
         """Picks a host that is up and has the fewest networks."""
 
-        results = db.service_get_all_network_sorted(context)
-        for result in results:
-            (service, instance_count) = result
-            if instance_count >= FLAGS.max_networks:
-                raise driver.NoValidHost(_("All hosts have too many networks"))
-            if self.service_is_up(service):
-                return service['host']
-        raise driver.NoValidHost(_("Scheduler was unable to locate a host"
-                                   " for this request. Is the appropriate"
-                                   " service running?"))
+        host = self._least_used_host(context, 'network', 1,
+                                     FLAGS.max_networks,
+                                     _("All hosts have too many networks"))
+        self.usage['network'].add(host, 1)
+        return host
@@ -0,0 +1,106 @@
+# Copyright (c) 2011 Openstack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Authenticated novaclient clients for the child zones, kept between
+requests so calls to a zone reuse its auth token and the HTTP keep-alive
+connections of the client instead of authenticating every time.
+"""
+
+import datetime
+import novaclient
+
+from eventlet import semaphore
+
+from nova import flags
+from nova import log as logging
+from nova import utils
+
+LOG = logging.getLogger('nova.scheduler.zone_clients')
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('zone_client_concurrency', 10,
+                     'Maximum number of concurrent requests to one'
+                     ' child zone')
+flags.DEFINE_integer('zone_client_token_ttl', 3600,
+                     'Seconds a child zone client is used before it'
+                     ' authenticates again')
+
+
+class ZoneClients(object):
+    """Idle authenticated clients for one child zone, and a semaphore
+       bounding the number of requests to it."""
+    def __init__(self, username, password, api_url):
+        self.username = username
+        self.password = password
+        self.api_url = api_url
+        self.semaphore = semaphore.Semaphore(FLAGS.zone_client_concurrency)
+        self.idle = []  # [ (authenticated at, client), ... ]
+
+    def get(self):
+        """Return (authenticated at, client), authenticating the client
+           if it is new or its token is older than zone_client_token_ttl."""
+        if self.idle:
+            authenticated_at, client = self.idle.pop()
+        else:
+            authenticated_at = None
+            client = novaclient.OpenStack(self.username, self.password,
+                                          self.api_url)
+        ttl = datetime.timedelta(seconds=FLAGS.zone_client_token_ttl)
+        now = utils.utcnow()
+        if authenticated_at is None or now - authenticated_at >= ttl:
+            LOG.debug(_("Authenticating to zone %s"), self.api_url)
+            client.authenticate()
+            authenticated_at = now
+        return authenticated_at, client
+
+    def put(self, authenticated_at, client):
+        """Keep client for the next request to the zone."""
+        self.idle.append((authenticated_at, client))
+
+
+class ZoneClientPool(object):
+    """ZoneClients by zone credentials."""
+    def __init__(self):
+        self.zones = {}  # { (<username>, <password>, <api_url>) : clients }
+
+    def clear(self):
+        self.zones.clear()
+
+    def call(self, zone, func, *args, **kwargs):
+        """Return func(client, *args, **kwargs) for an authenticated
+           client of zone, waiting while zone_client_concurrency calls
+           to the zone are running. The client is not reused if func
+           raises."""
+        key = (zone.username, zone.password, zone.api_url)
+        clients = self.zones.get(key)
+        if clients is None:
+            clients = self.zones[key] = ZoneClients(*key)
+        clients.semaphore.acquire()
+        try:
+            authenticated_at, client = clients.get()
+            result = func(client, *args, **kwargs)
+            clients.put(authenticated_at, client)
+            return result
+        finally:
+            clients.semaphore.release()
+
+
+POOL = ZoneClientPool()
+
+
+def call(zone, func, *args, **kwargs):
+    """Call func with an authenticated client of zone from the pool."""
+    return POOL.call(zone, func, *args, **kwargs)
@@ -17,7 +17,7 @@
 ZoneManager oversees all communications with child Zones.
 """
 
-import novaclient
+import bisect
 import thread
 import traceback
 
@@ -27,6 +27,8 @@ from eventlet import greenpool
 from nova import db
 from nova import flags
 from nova import log as logging
+from nova.scheduler import host_table
+from nova.scheduler import zone_clients
 
 FLAGS = flags.FLAGS
 flags.DEFINE_integer('zone_db_check_interval', 60,
@@ -86,10 +88,122 @@ class ZoneState(object):
                             "attempts. Marking inactive.") % locals())
 
 
+class HostCapacityIndex(object):
+    """Compute hosts sorted by free memory and by free disk, so hosts with
+       at least some amount of both are found without a scan of every
+       host. Kept current by ZoneManager.update_service_capabilities."""
+    def __init__(self):
+        self.hosts = set()  # every host the ZoneManager knows about
+        self.capacity = {}  # { <host> : (memory free, disk available) }
+        self.by_memory = []  # [ (memory free, host), ... ] sorted
+        self.by_disk = []  # [ (disk available, host), ... ] sorted
+        self.impure = set()  # hosts reporting capacity that isn't a number
+
+    def __len__(self):
+        return len(self.hosts)
+
+    def _remove(self, host):
+        memory, disk = self.capacity.pop(host)
+        del self.by_memory[bisect.bisect_left(self.by_memory, (memory, host))]
+        del self.by_disk[bisect.bisect_left(self.by_disk, (disk, host))]
+
+    def update(self, host, service_name, capabilities):
+        """Re-index host after an update of its service capabilities."""
+        self.hosts.add(host)
+        if service_name != 'compute':
+            return
+        if host in self.capacity:
+            self._remove(host)
+        self.impure.discard(host)
+        memory = capabilities.get('host_memory_free')
+        disk = capabilities.get('disk_available')
+        if memory is None or disk is None:
+            return
+        if not isinstance(memory, (int, long, float)) or \
+                not isinstance(disk, (int, long, float)):
+            self.impure.add(host)
+            return
+        self.capacity[host] = (memory, disk)
+        bisect.insort(self.by_memory, (memory, host))
+        bisect.insort(self.by_disk, (disk, host))
+
+    def hosts_with(self, memory, disk):
+        """Return the hosts with at least memory free and disk available.
+           Only the hosts past the more selective of the two bounds are
+           looked at."""
+        first_memory = bisect.bisect_left(self.by_memory, (memory,))
+        first_disk = bisect.bisect_left(self.by_disk, (disk,))
+        if len(self.by_memory) - first_memory <= \
+                len(self.by_disk) - first_disk:
+            return [host for _value, host in self.by_memory[first_memory:]
+                    if self.capacity[host][1] >= disk]
+        return [host for _value, host in self.by_disk[first_disk:]
+                if self.capacity[host][0] >= memory]
+
+
+class CapabilityRollup(object):
+    """The (min, max) of every <service>_<cap> over all the hosts, kept
+       up to date as capabilities arrive. When a value that was a min or
+       a max goes away only that capability is marked dirty, and it is
+       recomputed from its values on the next get."""
+    def __init__(self):
+        self.values = {}  # { <service>_<cap> : { <host> : value } }
+        self.combined = {}  # { <service>_<cap> : (min, max) }
+        self.dirty = set()  # capabilities whose min or max went away
+
+    def _retract(self, key, value):
+        if key in self.dirty:
+            return
+        min_value, max_value = self.combined[key]
+        if value == min_value or value == max_value:
+            self.dirty.add(key)
+
+    def _set(self, key, host, value):
+        values = self.values.setdefault(key, {})
+        if host in values:
+            if values[host] == value:
+                return
+            self._retract(key, values[host])
+        values[host] = value
+        if key in self.dirty:
+            return
+        min_value, max_value = self.combined.get(key, (value, value))
+        self.combined[key] = (min(min_value, value), max(max_value, value))
+
+    def _remove(self, key, host):
+        values = self.values[key]
+        value = values.pop(host)
+        if not values:
+            del self.values[key]
+            del self.combined[key]
+            self.dirty.discard(key)
+            return
+        self._retract(key, value)
+
+    def update(self, host, service_name, old, new):
+        """Replace the old capabilities of a service on host with new."""
+        for cap in old:
+            if cap not in new:
+                self._remove("%s_%s" % (service_name, cap), host)
+        for cap, value in new.iteritems():
+            self._set("%s_%s" % (service_name, cap), host, value)
+
+    def get(self):
+        """Return { <service>_<cap> : (min, max) } for every capability."""
+        for key in self.dirty:
+            values = self.values[key].values()
+            self.combined[key] = (min(values), max(values))
+        self.dirty.clear()
+        return dict(self.combined)
+
+
+def _zone_info(client):
+    return client.zones.info()._info
+
+
 def _call_novaclient(zone):
     """Call novaclient. Broken out for testing purposes."""
-    client = novaclient.OpenStack(zone.username, zone.password, zone.api_url)
-    return client.zones.info()._info
+    return zone_clients.call(zone, _zone_info)
 
 
 def _poll_zone(zone):
@@ -107,6 +221,10 @@ class ZoneManager(object):
         self.last_zone_db_check = datetime.min
         self.zone_states = {}  # { <zone_id> : ZoneState }
         self.service_states = {}  # { <host> : { <service> : { cap k : v }}}
+        self.service_sequences = {}  # { (<host>, <service>) : sequence }
+        self.host_table = host_table.HostTable()
+        self.capacity_index = HostCapacityIndex()
+        self.capability_rollup = CapabilityRollup()
         self.green_pool = greenpool.GreenPool()
 
     def get_zone_list(self):
@@ -117,22 +235,7 @@ class ZoneManager(object):
         """Roll up all the individual host info to generic 'service'
            capabilities. Each capability is aggregated into
            <cap>_min and <cap>_max values."""
-        hosts_dict = self.service_states
-
-        # TODO(sandy) - be smarter about fabricating this structure.
-        # But it's likely to change once we understand what the Best-Match
-        # code will need better.
-        combined = {}  # { <service>_<cap> : (min, max), ... }
-        for host, host_dict in hosts_dict.iteritems():
-            for service_name, service_dict in host_dict.iteritems():
-                for cap, value in service_dict.iteritems():
-                    key = "%s_%s" % (service_name, cap)
-                    min_value, max_value = combined.get(key, (value, value))
-                    min_value = min(min_value, value)
-                    max_value = max(max_value, value)
-                    combined[key] = (min_value, max_value)
-
-        return combined
+        return self.capability_rollup.get()
 
     def _refresh_from_db(self, context):
         """Make our zone state map match the db."""
@@ -165,10 +268,39 @@ class ZoneManager(object):
             self._refresh_from_db(context)
         self._poll_zones(context)
 
-    def update_service_capabilities(self, service_name, host, capabilities):
-        """Update the per-service capabilities based on this notification."""
+    def update_service_capabilities(self, service_name, host, capabilities,
+                                    sequence=None, removed=None, full=True):
+        """Update the per-service capabilities based on this notification.
+
+        Unless full is set capabilities only holds the changed values
+        and removed the names of the capabilities that went away. Returns
+        False, without applying it, for an update that doesn't follow
+        the last one seen from the service, which should then be asked
+        for a full snapshot.
+        """
         logging.debug(_("Received %(service_name)s service update from "
                             "%(host)s: %(capabilities)s") % locals())
         service_caps = self.service_states.get(host, {})
+        last_sequence = self.service_sequences.get((host, service_name))
+        if not full:
+            if last_sequence is not None and sequence is not None and \
+                    sequence <= last_sequence:
+                return True
+            if last_sequence is None or sequence != last_sequence + 1:
+                logging.debug(_("Missed %(service_name)s service updates "
+                                "from %(host)s before %(sequence)s")
+                              % locals())
+                return False
+            merged = dict(service_caps.get(service_name, {}))
+            merged.update(capabilities)
+            for key in removed or []:
+                merged.pop(key, None)
+            capabilities = merged
+        self.service_sequences[(host, service_name)] = sequence
+        self.capability_rollup.update(host, service_name,
+                service_caps.get(service_name, {}), capabilities)
         service_caps[service_name] = capabilities
         self.service_states[host] = service_caps
+        self.host_table.update(host, service_name, capabilities)
+        self.capacity_index.update(host, service_name, capabilities)
+        return True
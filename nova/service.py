@@ -37,6 +37,7 @@ from nova import rpc
 from nova import utils
 from nova import version
 from nova import wsgi
+from nova.db import threadpool
 
 
 FLAGS = flags.FLAGS
@@ -121,6 +122,17 @@ class Service(object):
             periodic.start(interval=self.periodic_interval, now=False)
             self.timers.append(periodic)
 
+        if FLAGS.rpc_stats_interval:
+            stats = utils.LoopingCall(rpc.log_stats)
+            stats.start(interval=FLAGS.rpc_stats_interval, now=False)
+            self.timers.append(stats)
+
+        if FLAGS.sql_thread_pool and FLAGS.sql_thread_pool_stats_interval:
+            db_stats = utils.LoopingCall(threadpool.log_stats)
+            db_stats.start(interval=FLAGS.sql_thread_pool_stats_interval,
+                           now=False)
+            self.timers.append(db_stats)
+
     def _create_service_ref(self, context):
         zone = FLAGS.node_availability_zone
         service_ref = db.service_create(context,
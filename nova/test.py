@@ -98,6 +98,7 @@ class TestCase(unittest.TestCase):
             # Clean out fake_rabbit's queue if we used it
             if FLAGS.fake_rabbit:
                 fakerabbit.reset_all()
+            rpc.ReplyConsumer.reset()
 
             # Reset any overriden flags
             self.reset_flags()
@@ -63,8 +63,22 @@ def return_server_with_power_state(power_state):
     return _return_server
 
 
-def return_servers(context, user_id=1):
-    return [stub_instance(i, user_id) for i in xrange(5)]
+def page_servers(servers, limit=None, marker=None, offset=None):
+    if marker is not None:
+        ids = [server['id'] for server in servers]
+        if marker not in ids:
+            raise exception.InstanceNotFound(instance_id=marker)
+        servers = servers[ids.index(marker) + 1:]
+    servers = servers[offset or 0:]
+    if limit is not None:
+        servers = servers[:limit]
+    return servers
+
+
+def return_servers(context, user_id=1, limit=None, marker=None, offset=None,
+                   sort_dir='asc', filters=None):
+    servers = [stub_instance(i, user_id) for i in xrange(5)]
+    return page_servers(servers, limit, marker, offset)
 
 
 def return_security_group(context, instance_id, security_group_id):
@@ -451,6 +465,52 @@ class ServersTest(test.TestCase):
         self.assertEqual(res.status_int, 400)
         self.assertTrue(res.body.find('marker param') > -1)
 
+    def test_get_servers_with_unknown_marker(self):
+        req = webob.Request.blank('/v1.1/servers?marker=99')
+        res = req.get_response(fakes.wsgi_app())
+        self.assertEqual(res.status_int, 400)
+        self.assertTrue(res.body.find('marker [99] not found') > -1)
+
+    def test_get_servers_pages_in_db(self):
+        requests = []
+
+        def return_servers_page(context, user_id, **paging):
+            requests.append(paging)
+            return []
+
+        self.stubs.Set(nova.db.api, 'instance_get_all_by_user',
+                       return_servers_page)
+        req = webob.Request.blank('/v1.1/servers?limit=2&marker=1'
+                                  '&status=active&name=server2&image=10'
+                                  '&changes-since=2011-01-02T03:04:05Z')
+        res = req.get_response(fakes.wsgi_app())
+        self.assertEqual(res.status_int, 200)
+        filters = requests[0].pop('filters')
+        self.assertEqual(requests[0], dict(limit=2, marker=1, offset=None,
+                                           sort_dir='asc'))
+        self.assertEqual(sorted(filters['state']),
+                         sorted([power_state.RUNNING, power_state.BLOCKED]))
+        self.assertEqual(filters['display_name'], 'server2')
+        self.assertEqual(filters['image_id'], 10)
+        self.assertEqual(filters['changes_since'],
+                         datetime.datetime(2011, 1, 2, 3, 4, 5))
+
+    def test_get_servers_with_bad_status(self):
+        req = webob.Request.blank('/v1.1/servers?status=sleeping')
+        res = req.get_response(fakes.wsgi_app())
+        self.assertEqual(res.status_int, 400)
+
+    def test_get_servers_with_bad_image(self):
+        def fail(context, user_id, **paging):
+            self.fail('Servers were listed for an invalid image')
+
+        self.stubs.Set(nova.db.api, 'instance_get_all_by_user', fail)
+        req = webob.Request.blank('/v1.1/servers?image='
+                                  'http://localhost/v1.1/images/abc')
+        res = req.get_response(fakes.wsgi_app())
+        self.assertEqual(res.status_int, 400)
+        self.assertTrue(res.body.find('Invalid image') > -1)
+
     def _setup_for_create_instance(self):
         """Shared implementation for tests below that create instance"""
         def instance_create(context, inst):
@@ -893,7 +953,7 @@ class ServersTest(test.TestCase):
         instances - 2 on one host and 3 on another.
         '''
 
-        def return_servers_with_host(context, user_id=1):
+        def return_servers_with_host(context, user_id=1, **paging):
             return [stub_instance(i, 1, None, None, i % 2) for i in xrange(5)]
 
         self.stubs.Set(nova.db.api, 'instance_get_all_by_user',
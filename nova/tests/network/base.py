@@ -30,11 +30,30 @@ from nova import log as logging
 from nova import test
 from nova import utils
 from nova.auth import manager
+from nova.network import allocator
 
 FLAGS = flags.FLAGS
 LOG = logging.getLogger('nova.tests.network')
 
 
+class RacingAllocatorDb(object):
+    """Db api where someone else takes the first free address first"""
+    def __init__(self):
+        self.free = [(1, '10.0.0.1'), (2, '10.0.0.2'), (3, '10.0.0.3')]
+        self.stolen = set([1])
+
+    def fixed_ip_get_free(self, context, network_id, limit):
+        return self.free[:limit]
+
+    def fixed_ip_associate_if_free(self, context, fixed_ip_id, network_id,
+                                   instance_id):
+        free = [ip for ip in self.free if ip[0] != fixed_ip_id]
+        if len(free) == len(self.free):
+            return False
+        self.free = free
+        return fixed_ip_id not in self.stolen
+
+
 class NetworkTestCase(test.TestCase):
     """Test cases for network code"""
     def setUp(self):
@@ -153,3 +172,32 @@ class NetworkTestCase(test.TestCase):
                      db.network_count_allocated_ips(admin_context,
                                                     network['id']))
         self.assertEqual(total_ips, net_size)
+
+    def test_floating_ip_bulk_create(self):
+        """Makes sure floating ips created in chunks are all there"""
+        self.flags(sql_bulk_insert_rows=3)
+        admin_context = context.get_admin_context()
+        addresses = [str(address) for address in IPy.IP('10.9.9.0/29')]
+        db.floating_ip_bulk_create(admin_context,
+                                   [{'address': address, 'host': 'bulkhost'}
+                                    for address in addresses])
+        floating_ips = db.floating_ip_get_all_by_host(admin_context,
+                                                      'bulkhost')
+        self.assertEqual(sorted(ip['address'] for ip in floating_ips),
+                         sorted(addresses))
+        for address in addresses:
+            db.floating_ip_destroy(admin_context, address)
+
+    def test_allocator_moves_on_when_address_is_taken(self):
+        """Makes sure an address claimed concurrently is skipped"""
+        self.flags(ip_allocation_batch=1)
+        racing_allocator = allocator.AddressAllocator(RacingAllocatorDb())
+        self.assertEqual(racing_allocator.allocate_fixed_ip(self.context,
+                                                            1, 1),
+                         '10.0.0.2')
+        self.assertEqual(racing_allocator.allocate_fixed_ip(self.context,
+                                                            1, 2),
+                         '10.0.0.3')
+        self.assertRaises(db.NoMoreAddresses,
+                          racing_allocator.allocate_fixed_ip,
+                          self.context, 1, 3)
@@ -219,6 +219,30 @@ class CloudTestCase(test.TestCase):
         db.service_destroy(self.context, comp1['id'])
         db.service_destroy(self.context, comp2['id'])
 
+    def test_describe_instances_pages(self):
+        """Makes sure describe_instances pages by max_results"""
+        instance_ids = [db.instance_create(self.context,
+                                           {'reservation_id': 'a',
+                                            'image_id': 1})['id']
+                        for i in xrange(3)]
+        ec2_ids = [ec2utils.id_to_ec2_id(instance_id)
+                   for instance_id in instance_ids]
+
+        def described(result):
+            return [instance['instanceId']
+                    for reservation in result['reservationSet']
+                    for instance in reservation['instancesSet']]
+
+        result = self.cloud.describe_instances(self.context, max_results=2)
+        self.assertEqual(described(result), ec2_ids[:2])
+        self.assertEqual(result['nextToken'], ec2_ids[1])
+        result = self.cloud.describe_instances(self.context, max_results=2,
+                                               next_token=ec2_ids[1])
+        self.assertEqual(described(result), ec2_ids[2:])
+        self.assertFalse('nextToken' in result)
+        for instance_id in instance_ids:
+            db.instance_destroy(self.context, instance_id)
+
     def test_describe_images(self):
         describe_images = self.cloud.describe_images
 
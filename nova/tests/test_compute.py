@@ -211,6 +211,53 @@ class ComputeTestCase(test.TestCase):
         LOG.info(_("After terminating instances: %s"), instances)
         self.assertEqual(len(instances), 0)
 
+    def test_get_all_pages_by_marker(self):
+        """Make sure instance listings are paged by limit and marker"""
+        instance_ids = [self._create_instance() for i in xrange(5)]
+        try:
+            def page(**paging):
+                return [instance['id'] for instance
+                        in self.compute_api.get_all(self.context, **paging)]
+
+            self.assertEqual(page(limit=2), instance_ids[:2])
+            self.assertEqual(page(limit=2, marker=instance_ids[1]),
+                             instance_ids[2:4])
+            self.assertEqual(page(marker=instance_ids[3]), instance_ids[4:])
+            self.assertEqual(page(limit=2, marker=instance_ids[3],
+                                  sort_dir='desc'),
+                             [instance_ids[2], instance_ids[1]])
+            self.assertEqual(page(limit=2, offset=3), instance_ids[3:])
+            self.assertRaises(exception.InstanceNotFound, page,
+                              marker=instance_ids[-1] + 100)
+        finally:
+            for instance_id in instance_ids:
+                db.instance_destroy(self.context, instance_id)
+
+    def test_get_all_filters(self):
+        """Make sure instance listings are filtered by the db"""
+        running = self._create_instance({'state': power_state.RUNNING,
+                                         'display_name': 'web'})
+        old = self._create_instance({'state': power_state.SHUTDOWN,
+                                     'image_id': 2,
+                                     'created_at': datetime.datetime(2010,
+                                                                     1, 1)})
+        try:
+            def listed(**filters):
+                return [instance['id'] for instance
+                        in self.compute_api.get_all(self.context,
+                                                    filters=filters)]
+
+            self.assertEqual(listed(state=[power_state.RUNNING]), [running])
+            self.assertEqual(listed(state=power_state.SHUTDOWN), [old])
+            self.assertEqual(listed(display_name='web'), [running])
+            self.assertEqual(listed(image_id=2), [old])
+            self.assertEqual(listed(changes_since=datetime.datetime(2011,
+                                                                    1, 1)),
+                             [running])
+        finally:
+            db.instance_destroy(self.context, running)
+            db.instance_destroy(self.context, old)
+
     def test_run_terminate_timestamps(self):
         """Make sure timestamps are set for launched and destroyed"""
         instance_id = self._create_instance()
@@ -0,0 +1,144 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests that the hot db queries are answered from an index
+
+Each test runs a db api call against the seeded sqlite test database,
+records the SELECTs it issues and fails if EXPLAIN QUERY PLAN shows a
+full scan of one of the nova tables for any of them.
+"""
+
+import re
+
+from sqlalchemy import create_engine
+from sqlalchemy import interfaces
+from sqlalchemy import pool
+
+from nova import context
+from nova import db
+from nova import flags
+from nova import test
+from nova.db.sqlalchemy import session
+
+FLAGS = flags.FLAGS
+
+# "SCAN TABLE instances" on older sqlite, "SCAN instances_1" on newer
+SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)')
+
+
+class RecordingProxy(interfaces.ConnectionProxy):
+    """Keeps the SELECT statements executed, with their parameters"""
+    def __init__(self):
+        self.selects = []
+
+    def cursor_execute(self, execute, cursor, statement, parameters,
+                       context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            self.selects.append((statement, parameters))
+        return execute(cursor, statement, parameters, context)
+
+
+class QueryPlanTestCase(test.TestCase):
+    """Test case for the query plans of the hot db queries"""
+    def setUp(self):
+        super(QueryPlanTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        self.proxy = RecordingProxy()
+        self.engine = create_engine(FLAGS.sql_connection,
+                                    poolclass=pool.NullPool,
+                                    proxy=self.proxy)
+        self.stubs.Set(session, '_ENGINE', self.engine)
+        self.stubs.Set(session, '_MAKER', None)
+        # plans are explained on an engine of their own, so the queries
+        # made for them are not recorded along with the ones under test
+        self.plain_engine = create_engine(FLAGS.sql_connection,
+                                          poolclass=pool.NullPool)
+        self.tables = set(name for name, in self.plain_engine.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"))
+        self._seed()
+        self.proxy.selects = []
+
+    def _seed(self):
+        for i in xrange(60):
+            db.instance_create(self.context,
+                               {'project_id': 'project%d' % (i % 3),
+                                'user_id': 'fake',
+                                'host': 'host%d' % (i % 5),
+                                'reservation_id': 'r-%d' % (i % 10)})
+        for i in xrange(20):
+            db.service_create(self.context, {'host': 'host%d' % i,
+                                             'binary': 'nova-compute',
+                                             'topic': 'compute',
+                                             'report_count': 0})
+        db.floating_ip_bulk_create(self.context,
+                                   [{'address': '4.4.4.%d' % i,
+                                     'host': 'host%d' % (i % 5)}
+                                    for i in xrange(1, 60)])
+
+    def _table_scans(self, statement, parameters):
+        connection = self.plain_engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+            plan = [row[-1] for row in cursor.fetchall()]
+        finally:
+            connection.close()
+        scans = []
+        for detail in plan:
+            match = SCAN.match(detail)
+            # joined tables are aliased as <table>_<n>
+            table = match and re.sub(r'_\d+$', '', match.group(1))
+            if table in self.tables or 'AUTOMATIC' in detail:
+                scans.append(detail)
+        return scans
+
+    def assertIndexed(self, call, *args):
+        self.proxy.selects = []
+        call(self.context, *args)
+        selects = list(self.proxy.selects)
+        self.assertTrue(selects)
+        for statement, parameters in selects:
+            scans = self._table_scans(statement, parameters)
+            self.assertFalse(scans, '%s scans %s' % (statement, scans))
+
+    def test_instance_get_all_by_project(self):
+        self.assertIndexed(db.instance_get_all_by_project, 'project1')
+
+    def test_instance_get_all_by_host(self):
+        self.assertIndexed(db.instance_get_all_by_host, 'host1')
+
+    def test_instance_get_all_by_reservation(self):
+        self.assertIndexed(db.instance_get_all_by_reservation, 'r-1')
+
+    def test_fixed_ip_get_by_address(self):
+        address = db.fixed_ip_get_free(self.context, 1, 1)[0][1]
+        self.assertIndexed(db.fixed_ip_get_by_address, address)
+
+    def test_fixed_ip_get_free(self):
+        self.assertIndexed(db.fixed_ip_get_free, 1, 32)
+
+    def test_floating_ip_get_by_address(self):
+        self.assertIndexed(db.floating_ip_get_by_address, '4.4.4.1')
+
+    def test_floating_ip_get_free(self):
+        self.assertIndexed(db.floating_ip_get_free, 'host1', 32)
+
+    def test_service_get_all_by_topic(self):
+        self.assertIndexed(db.service_get_all_by_topic, 'compute')
+
+    def test_service_get_by_args(self):
+        self.assertIndexed(db.service_get_by_args, 'host1', 'nova-compute')
@@ -0,0 +1,117 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For running db calls in a thread pool
+"""
+
+import eventlet
+from eventlet import patcher
+
+from nova import exception
+from nova import test
+from nova.db import threadpool
+
+_thread = patcher.original('thread')
+_time = patcher.original('time')
+
+
+class FakeDbApi(object):
+    """Db backend whose functions report the thread they ran in"""
+    NotFound = exception.NotFound
+
+    @staticmethod
+    def thread_ident():
+        return _thread.get_ident()
+
+    @staticmethod
+    def nested_thread_ident():
+        return (_thread.get_ident(), IMPL.thread_ident())
+
+    @staticmethod
+    def fail():
+        raise exception.NotFound()
+
+    @staticmethod
+    def slow(seconds):
+        _time.sleep(seconds)
+
+
+IMPL = threadpool.ThreadPooledBackend(FakeDbApi())
+
+
+class ThreadPoolTestCase(test.TestCase):
+    """Test case for the db thread pool"""
+    def setUp(self):
+        super(ThreadPoolTestCase, self).setUp()
+        threadpool._POOL = None
+        threadpool.STATS.reset()
+
+    def tearDown(self):
+        threadpool._POOL = None
+        super(ThreadPoolTestCase, self).tearDown()
+
+    def test_calls_run_in_caller_without_flag(self):
+        self.flags(sql_thread_pool=False)
+        self.assertEqual(IMPL.thread_ident(), _thread.get_ident())
+        self.assertEqual(threadpool.STATS.calls, 0)
+
+    def test_calls_run_in_pool_thread(self):
+        self.flags(sql_thread_pool=True)
+        self.assertNotEqual(IMPL.thread_ident(),
+                            _thread.get_ident())
+        self.assertEqual(threadpool.STATS.calls, 1)
+
+    def test_nested_calls_stay_in_pool_thread(self):
+        self.flags(sql_thread_pool=True, sql_thread_pool_size=1)
+        outer, inner = IMPL.nested_thread_ident()
+        self.assertEqual(outer, inner)
+        self.assertEqual(threadpool.STATS.calls, 1)
+
+    def test_exceptions_are_raised_in_caller(self):
+        self.flags(sql_thread_pool=True)
+        self.assertRaises(exception.NotFound, IMPL.fail)
+        self.assertEqual(threadpool.STATS.running, 0)
+
+    def test_classes_are_not_wrapped(self):
+        self.flags(sql_thread_pool=True)
+        self.assertTrue(IMPL.NotFound is exception.NotFound)
+
+    def test_waits_for_free_thread_are_counted(self):
+        self.flags(sql_thread_pool=True, sql_thread_pool_size=1)
+        calls = [eventlet.spawn(IMPL.slow, 0.1) for i in xrange(2)]
+        for call in calls:
+            call.wait()
+        stats = threadpool.STATS.to_dict()
+        self.assertEqual(stats['calls'], 2)
+        self.assertEqual(stats['waits'], 1)
+        self.assertTrue(stats['max_wait'] > 0)
+        self.assertEqual(stats['running'], 0)
+
+    def test_calls_admitted_right_away_are_not_waits(self):
+        self.flags(sql_thread_pool=True, sql_thread_pool_size=2)
+        calls = [eventlet.spawn(IMPL.slow, 0.01) for i in xrange(2)]
+        for call in calls:
+            call.wait()
+        stats = threadpool.STATS.to_dict()
+        self.assertEqual(stats['calls'], 2)
+        self.assertEqual(stats['waits'], 0)
+        self.assertEqual(stats['max_wait'], 0)
+
+    def test_log_stats(self):
+        self.flags(sql_thread_pool=True)
+        IMPL.thread_ident()
+        threadpool.log_stats()
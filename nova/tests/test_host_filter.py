@@ -22,6 +22,8 @@ from nova import exception
 from nova import flags
 from nova import test
 from nova.scheduler import host_filter
+from nova.scheduler import host_table
+from nova.scheduler import zone_manager
 
 FLAGS = flags.FLAGS
 
@@ -206,3 +208,139 @@ class HostFilterTestCase(test.TestCase):
         self.assertFalse(driver.filter_hosts(self.zone_manager, json.dumps(
                 ['=', {}, ['>', '$missing....foo']]
             )))
+
+    def test_json_driver_compiled_matches_interpreter(self):
+        driver = host_filter.JsonFilter()
+        queries = [
+            ['and',
+                ['>=', '$compute.host_memory_free', 50],
+                ['>=', '$compute.disk_available', 500]],
+            ['or',
+                ['not', ['=', '$compute.host_memory_free', 30]],
+                ['in', '$compute.disk_used', 0, 1]],
+            ['=', '$compute.host_hostname', 'xs-3'],
+            ['<', '$compute.missing', '', None, 10],
+            ['=', {}, ['>', '$missing....foo']],
+            ['and', ['<', '$compute.host_memory_free', 40], True],
+            ['or', ['not', ['>', '$compute.disk_available', 500]]],
+            ['and'],
+            ['or'],
+            [],
+        ]
+        for query in queries:
+            compiled = driver.compile(json.dumps(query))
+            for host, services in self.zone_manager.service_states.items():
+                self.assertEqual(compiled(services),
+                                 driver._process_filter(self.zone_manager,
+                                                        query, host,
+                                                        services))
+
+    def test_json_driver_caches_compiled_queries(self):
+        driver = host_filter.JsonFilter()
+        name, cooked = driver.instance_type_to_filter(self.instance_type)
+        compiled = driver.compile(cooked)
+        self.assertTrue(host_filter.JsonFilter().compile(cooked) is compiled)
+
+    def _zone_manager_with_table(self):
+        zm = zone_manager.ZoneManager()
+        for host, services in self.zone_manager.service_states.iteritems():
+            for service_name, capabilities in services.iteritems():
+                zm.update_service_capabilities(service_name, host,
+                                               capabilities)
+        # A host without compute capabilities and one reporting zero
+        # free memory, which JsonFilter lookups treat as missing.
+        zm.update_service_capabilities('volume', 'host11', {})
+        zm.update_service_capabilities('compute', 'host12',
+                                       dict(self._host_caps(3),
+                                            host_memory_free=0))
+        return zm
+
+    def test_vectorized_filters_match_per_host_filters(self):
+        if not host_table.numpy:
+            return
+        zm = self._zone_manager_with_table()
+        self.assertEqual(len(zm.host_table), 12)
+        driver = host_filter.JsonFilter()
+        queries = [
+            ['and',
+                ['>=', '$compute.host_memory_free', 50],
+                ['>=', '$compute.disk_available', 500]],
+            ['or',
+                ['<', '$compute.host_memory_free', 30],
+                ['>', '$compute.disk_available', 700]],
+            ['not', ['=', '$compute.host_memory_free', 30]],
+            ['not', ['<=', '$compute.disk_available', 300],
+                    ['>', '$compute.host_memory_free', 10]],
+            ['in', '$compute.host_memory_free', 20, 40, 60],
+            ['in', '$compute.host_memory_free', 20, 20],
+            ['<', '$compute.host_memory_free', '', None, 10000],
+        ]
+        for query in queries:
+            cooked = json.dumps(query)
+            self.assertTrue(driver.compile_vector(cooked))
+            expected = sorted(self._per_host(driver, zm, cooked))
+            self.assertEqual(sorted(driver.filter_hosts(zm, cooked)),
+                             expected)
+
+    def test_indexed_flavor_driver(self):
+        zm = zone_manager.ZoneManager()
+        for host, services in self.zone_manager.service_states.iteritems():
+            zm.update_service_capabilities('compute', host,
+                                           services['compute'])
+        driver = host_filter.FlavorFilter()
+        name, cooked = driver.instance_type_to_filter(self.instance_type)
+        hosts = driver.filter_hosts(zm, cooked)
+        self.assertEqual(sorted(hosts),
+                         sorted(driver.filter_hosts(self.zone_manager,
+                                                    cooked)))
+        self.assertEqual(6, len(hosts))
+
+    def test_capacity_index_follows_updates(self):
+        zm = self._zone_manager_with_table()
+        index = zm.capacity_index
+        self.assertEqual(len(index), 12)
+        self.assertEqual(sorted(index.hosts_with(50, 500)),
+                         ['host05', 'host06', 'host07', 'host08', 'host09',
+                          'host10'])
+        self.assertEqual(index.hosts_with(0, 1000), ['host10'])
+        zm.update_service_capabilities('compute', 'host10',
+                                       self._host_caps(1))
+        zm.update_service_capabilities('compute', 'host01',
+                                       self._host_caps(10))
+        self.assertEqual(index.hosts_with(0, 1000), ['host01'])
+        self.assertEqual(index.hosts_with(100, 0), ['host01'])
+        self.assertEqual(len(index.by_memory), 11)
+        self.assertEqual(len(index.by_disk), 11)
+
+        zm.update_service_capabilities('compute', 'host03',
+                                       dict(self._host_caps(3),
+                                            host_memory_free='lots'))
+        self.assertEqual(None, host_filter._capacity_index(zm))
+        zm.update_service_capabilities('compute', 'host03',
+                                       self._host_caps(3))
+        self.assertEqual(index, host_filter._capacity_index(zm))
+
+    def _per_host(self, driver, zm, query):
+        hosts = []
+        compiled = driver.compile(query)
+        for host, services in zm.service_states.iteritems():
+            r = compiled(services)
+            if isinstance(r, list):
+                r = True in r
+            if r:
+                hosts.append((host, services))
+        return hosts
+
+    def test_json_driver_falls_back_for_impure_columns(self):
+        if not host_table.numpy:
+            return
+        zm = self._zone_manager_with_table()
+        zm.update_service_capabilities('compute', 'host12',
+                                       dict(self._host_caps(3),
+                                            host_memory_free='lots'))
+        self.assertEqual(zm.host_table.column('compute.host_memory_free'),
+                         None)
+        driver = host_filter.JsonFilter()
+        cooked = json.dumps(['>=', '$compute.host_memory_free', 50])
+        self.assertEqual(sorted(driver.filter_hosts(zm, cooked)),
+                         sorted(self._per_host(driver, zm, cooked)))
@@ -19,7 +19,15 @@
 Unit Tests for remote procedure calls using queue
 """
 
+import itertools
+import time
+
+from eventlet import event
+from eventlet import greenpool
+from eventlet import greenthread
+
 from nova import context
+from nova import fakerabbit
 from nova import flags
 from nova import log as logging
 from nova import rpc
@@ -108,6 +116,415 @@ class RpcTestCase(test.TestCase):
                                               "value": value}})
         self.assertEqual(value, result)
 
+    def test_concurrent_calls_share_reply_queue(self):
+        """Test that concurrent calls are answered through one queue"""
+        pool = greenpool.GreenPool()
+        calls = [pool.spawn(rpc.call, self.context, 'test',
+                            {"method": "echo", "args": {"value": value}})
+                 for value in xrange(5)]
+        self.assertEqual([call.wait() for call in calls], range(5))
+        reply_queues = [queue for queue in fakerabbit.QUEUES
+                        if queue.startswith('reply_')]
+        self.assertEqual(len(reply_queues), 1)
+        self.assertEqual(rpc.ReplyConsumer.instance().waiters, {})
+
+    def test_reply_consumer_created_once(self):
+        """Test that concurrent first calls share one reply consumer"""
+        rpc.ReplyConsumer.reset()
+        original_instance = rpc.Connection.instance
+
+        def instance(*args, **kwargs):
+            greenthread.sleep(0)
+            return original_instance(*args, **kwargs)
+
+        self.stubs.Set(rpc.Connection, 'instance', staticmethod(instance))
+        pool = greenpool.GreenPool()
+        consumers = [pool.spawn(rpc.ReplyConsumer.instance)
+                     for i in xrange(3)]
+        consumers = set(consumer.wait() for consumer in consumers)
+        self.assertEqual(len(consumers), 1)
+
+    def test_cast_many(self):
+        """Test that a batch is dispatched as separate messages"""
+        received = []
+
+        class Recorder(object):
+            @staticmethod
+            def record(context, value):
+                received.append((context.to_dict(), value))
+
+        consumer = rpc.TopicAdapterConsumer(
+                connection=rpc.Connection.instance(True),
+                topic='batch',
+                proxy=Recorder())
+        consumer.attach_to_eventlet()
+        rpc.cast_many(self.context, 'batch',
+                      [{"method": "record", "args": {"value": value}}
+                       for value in xrange(3)])
+        for i in xrange(10):
+            greenthread.sleep(0)
+        self.assertEqual(received, [(self.context.to_dict(), value)
+                                    for value in xrange(3)])
+
+    def test_serialize_compresses_large_messages(self):
+        """Test that only bodies above the threshold are compressed"""
+        self.flags(rpc_compression_threshold=64)
+        small = {'method': 'echo', 'args': {'value': 'x'}}
+        large = {'method': 'echo', 'args': {'value': 'x' * 1024}}
+        content_type, content_encoding, body = rpc.serialize(small)
+        self.assertEqual(content_type, 'application/json')
+        self.assertEqual(rpc.deserialize(body, content_type,
+                                         content_encoding), small)
+        content_type, content_encoding, body = rpc.serialize(large)
+        self.assertEqual(content_type, 'application/json+zlib')
+        self.assertTrue(len(body) < 64)
+        self.assertEqual(rpc.deserialize(body, content_type,
+                                         content_encoding), large)
+
+    def test_call_compressed(self):
+        """Test a call whose request and reply are compressed"""
+        self.flags(rpc_compression_threshold=64)
+        value = 'x' * 1024
+        result = rpc.call(self.context, 'test', {"method": "echo",
+                                                 "args": {"value": value}})
+        self.assertEqual(value, result)
+
+    def test_call_msgpack(self):
+        """Test a call serialized with msgpack"""
+        if not rpc.msgpack:
+            return
+        self.flags(rpc_serializer='msgpack')
+        value = {'a': [1, 2, 3], 'b': 'c'}
+        result = rpc.call(self.context, 'test', {"method": "echo",
+                                                 "args": {"value": value}})
+        self.assertEqual(value, result)
+
+    def test_bulk_lane_does_not_starve_other_lanes(self):
+        """Test that a full bulk lane leaves other methods responsive"""
+        self.flags(rpc_bulk_methods=['block'], rpc_bulk_lane_size=1)
+        receiver = BlockingReceiver()
+        consumer = rpc.TopicAdapterConsumer(
+                connection=rpc.Connection.instance(True),
+                topic='lanes',
+                proxy=receiver)
+        consumer.attach_to_eventlet()
+        for i in xrange(3):
+            rpc.cast(self.context, 'lanes', {"method": "block", "args": {}})
+        result = rpc.call(self.context, 'lanes', {"method": "echo",
+                                                  "args": {"value": 42}})
+        self.assertEqual(result, 42)
+        self.assertEqual(receiver.blocked, 1)
+        receiver.unblock.send()
+        for i in xrange(10):
+            greenthread.sleep(0)
+        self.assertEqual(receiver.blocked, 3)
+
+    def test_saturating_bulk_does_not_delay_priority(self):
+        """Test that bulk messages filling the consumer admit priority"""
+        self.flags(rpc_bulk_methods=['block'], rpc_priority_methods=['echo'],
+                   rpc_thread_pool_size=2, rpc_bulk_lane_size=2)
+        receiver = BlockingReceiver()
+        consumer = rpc.TopicAdapterConsumer(
+                connection=rpc.Connection.instance(True),
+                topic='saturated_bulk',
+                proxy=receiver)
+        consumer.attach_to_eventlet()
+        for i in xrange(2):
+            rpc.cast(self.context, 'saturated_bulk',
+                     {"method": "block", "args": {}})
+        for i in xrange(10):
+            greenthread.sleep(0)
+        self.assertEqual(receiver.blocked, 2)
+        self.assertFalse(consumer.can_accept())
+        result = rpc.call(self.context, 'saturated_bulk',
+                          {"method": "echo", "args": {"value": 42}},
+                          timeout=1)
+        self.assertEqual(result, 42)
+        receiver.unblock.send()
+
+    def test_saturated_consumer_stops_fetching(self):
+        """Test that messages stay queued while the consumer is full"""
+        self.flags(rpc_thread_pool_size=1)
+        receiver = BlockingReceiver()
+        consumer = rpc.TopicAdapterConsumer(
+                connection=rpc.Connection.instance(True),
+                topic='saturated',
+                proxy=receiver)
+        consumer.attach_to_eventlet()
+        for i in xrange(3):
+            rpc.cast(self.context, 'saturated',
+                     {"method": "block", "args": {}})
+        for i in xrange(10):
+            greenthread.sleep(0)
+        # One message is running and one is waiting to be admitted.
+        self.assertEqual(receiver.blocked, 1)
+        self.assertEqual(fakerabbit.QUEUES['saturated'].size(), 1)
+        receiver.unblock.send()
+        for i in xrange(10):
+            greenthread.sleep(0)
+        self.assertEqual(receiver.blocked, 3)
+        self.assertEqual(fakerabbit.QUEUES['saturated'].size(), 0)
+
+    def test_local_dispatch_skips_broker(self):
+        """Test that calls to a topic consumed here skip the broker"""
+        self.flags(rpc_local_dispatch=True)
+
+        def fail(*args, **kwargs):
+            self.fail('Message was sent through the broker')
+
+        self.stubs.Set(rpc.Publisher, 'send', fail)
+        value = {'a': [1, 2]}
+        result = rpc.call(self.context, 'test', {"method": "echo",
+                                                 "args": {"value": value}})
+        self.assertEqual(value, result)
+
+    def test_local_dispatch_falls_back_to_broker(self):
+        """Test that remote topics and saturated consumers use the broker"""
+        self.flags(rpc_local_dispatch=True, rpc_thread_pool_size=1)
+        sent = []
+        original_send = rpc.Publisher.send
+
+        def send(publisher, message_data, **kwargs):
+            sent.append(message_data['method'])
+            return original_send(publisher, message_data, **kwargs)
+
+        self.stubs.Set(rpc.Publisher, 'send', send)
+        receiver = BlockingReceiver()
+        consumer = rpc.TopicAdapterConsumer(
+                connection=rpc.Connection.instance(True),
+                topic='local',
+                proxy=receiver)
+        consumer.attach_to_eventlet()
+        rpc.cast(self.context, 'remote', {"method": "echo",
+                                          "args": {"value": 1}})
+        rpc.cast(self.context, 'local', {"method": "block", "args": {}})
+        rpc.cast(self.context, 'local', {"method": "echo",
+                                         "args": {"value": 2}})
+        for i in xrange(10):
+            greenthread.sleep(0)
+        self.assertEqual(sent, ['echo', 'echo'])
+        self.assertEqual(receiver.blocked, 1)
+        receiver.unblock.send()
+
+    def test_local_batch_falls_back_without_blocking(self):
+        """Test that a batch a local consumer cannot admit at once goes
+        through the broker"""
+        self.flags(rpc_local_dispatch=True, rpc_thread_pool_size=1)
+        sent = []
+        original_send = rpc.Publisher.send
+
+        def send(publisher, message_data, **kwargs):
+            sent.append(len(message_data['_batch']))
+            return original_send(publisher, message_data, **kwargs)
+
+        self.stubs.Set(rpc.Publisher, 'send', send)
+        receiver = BlockingReceiver()
+        consumer = rpc.TopicAdapterConsumer(
+                connection=rpc.Connection.instance(True),
+                topic='local_batch',
+                proxy=receiver)
+        consumer.attach_to_eventlet()
+        rpc.cast_many(self.context, 'local_batch',
+                      [{"method": "block", "args": {}}] * 2)
+        self.assertEqual(sent, [2])
+        self.assertEqual(consumer.in_flight_count(), 0)
+        receiver.unblock.send()
+
+    def test_local_call_records_no_lag(self):
+        """Test that calls skipping the broker are not stamped for lag"""
+        self.flags(rpc_local_dispatch=True)
+        rpc.STATS.reset()
+        rpc.call(self.context, 'test', {"method": "echo",
+                                        "args": {"value": 42}})
+        kinds = sorted(timing['kind'] for timing in
+                       rpc.STATS.report()['timings']
+                       if (timing['topic'], timing['method']) ==
+                          ('test', 'echo'))
+        self.assertEqual(kinds, ['handler', 'round_trip'])
+
+    def test_call_records_stats(self):
+        """Test that calls record their lag, handler and round trip"""
+        rpc.STATS.reset()
+        rpc.call(self.context, 'test', {"method": "echo",
+                                        "args": {"value": 42}})
+        report = rpc.STATS.report()
+        kinds = sorted(timing['kind'] for timing in report['timings']
+                       if (timing['topic'], timing['method']) ==
+                          ('test', 'echo'))
+        self.assertEqual(kinds, ['handler', 'lag', 'round_trip'])
+        self.assertEqual(report['calls_in_flight'], 0)
+        self.assertEqual(report['consumers_in_flight']['test'], 0)
+        rpc.log_stats()
+
+    def test_call_streamed_results(self):
+        """Test that a generator's results come back in chunks"""
+        self.flags(rpc_stream_chunk_size=2)
+        sent = []
+        original_send = rpc.Publisher.send
+
+        def send(publisher, message_data, **kwargs):
+            if '_seq' in message_data:
+                sent.append(message_data['result'])
+            return original_send(publisher, message_data, **kwargs)
+
+        self.stubs.Set(rpc.Publisher, 'send', send)
+        result = rpc.call(self.context, 'test', {"method": "count",
+                                                 "args": {"value": 5}})
+        self.assertEqual(result, range(5))
+        self.assertEqual(sent, [[0, 1], [2, 3], [4]])
+
+    def test_call_stream_returns_iterator(self):
+        """Test that stream=True yields the results as they arrive"""
+        self.flags(rpc_stream_chunk_size=2)
+        results = rpc.call(self.context, 'test', {"method": "count",
+                                                  "args": {"value": 3}},
+                           stream=True)
+        self.assertEqual(results.next(), 0)
+        self.assertEqual(list(results), [1, 2])
+        self.assertEqual(rpc.ReplyConsumer.instance().waiters, {})
+        results = rpc.call(self.context, 'test', {"method": "echo",
+                                                  "args": {"value": 42}},
+                           stream=True)
+        self.assertEqual(list(results), [42])
+
+    def test_call_streamed_failure(self):
+        """Test that a generator raising ends the stream with an error"""
+        self.flags(rpc_stream_chunk_size=2)
+        results = rpc.call(self.context, 'test', {"method": "count",
+                                                  "args": {"value": 3,
+                                                           "fail": True}},
+                           stream=True)
+        self.assertEqual(list(itertools.islice(results, 3)), [0, 1, 2])
+        self.assertRaises(rpc.RemoteError, results.next)
+        self.assertEqual(rpc.ReplyConsumer.instance().waiters, {})
+
+    def test_reply_waiter_orders_chunks(self):
+        """Test that chunks arriving out of order are handed out in order"""
+        waiter = rpc.ReplyWaiter()
+        for seq in (2, 0, 1):
+            waiter.put({'_seq': seq})
+        self.assertEqual([waiter.get()['_seq'] for i in xrange(3)],
+                         [0, 1, 2])
+
+    def test_call_timeout(self):
+        """Test that a call gives up when no response arrives in time"""
+        self.assertRaises(rpc.Timeout,
+                          rpc.call,
+                          self.context,
+                          'test',
+                          {"method": "sleep", "args": {"value": 0.5}},
+                          timeout=0.05)
+        self.assertEqual(rpc.ReplyConsumer.instance().waiters, {})
+
+    def test_call_uses_response_timeout_flag(self):
+        """Test that calls default to the rpc_response_timeout flag"""
+        self.flags(rpc_response_timeout=0.05)
+        self.assertRaises(rpc.Timeout,
+                          rpc.call,
+                          self.context,
+                          'test',
+                          {"method": "sleep", "args": {"value": 0.5}})
+
+    def test_expired_call_is_dropped(self):
+        """Test that a message past its deadline is not run"""
+        received = []
+
+        class Recorder(object):
+            @staticmethod
+            def record(context, value):
+                received.append(value)
+
+        consumer = rpc.TopicAdapterConsumer(
+                connection=rpc.Connection.instance(True),
+                topic='deadline',
+                proxy=Recorder())
+        consumer.attach_to_eventlet()
+        rpc.cast(self.context, 'deadline', {"method": "record",
+                                            "args": {"value": 1},
+                                            "_deadline": time.time() - 1})
+        rpc.cast(self.context, 'deadline', {"method": "record",
+                                            "args": {"value": 2},
+                                            "_deadline": time.time() + 60})
+        for i in xrange(10):
+            greenthread.sleep(0)
+        self.assertEqual(received, [2])
+
+    def test_consumer_applies_prefetch_count(self):
+        """Test that consumers ask the broker for a prefetch limit"""
+        self.flags(rpc_prefetch_count=5)
+        self.mox.StubOutWithMock(rpc.Consumer, 'qos')
+        rpc.Consumer.qos(prefetch_count=5)
+        self.mox.ReplayAll()
+        rpc.TopicAdapterConsumer(connection=rpc.Connection.instance(True),
+                                 topic='prefetch',
+                                 proxy=self.receiver)
+
+    def test_stopped_consumer_stops_dispatching(self):
+        """Test that messages are pushed until the consumer is stopped"""
+        received = []
+
+        class Recorder(object):
+            @staticmethod
+            def record(context, value):
+                received.append(value)
+
+        consumer = rpc.TopicAdapterConsumer(
+                connection=rpc.Connection.instance(True),
+                topic='stoppable',
+                proxy=Recorder())
+        thread = consumer.attach_to_eventlet()
+        rpc.cast(self.context, 'stoppable', {"method": "record",
+                                             "args": {"value": 1}})
+        for i in xrange(10):
+            greenthread.sleep(0)
+        self.assertEqual(received, [1])
+
+        thread.stop()
+        self.assertEqual(thread.wait(), None)
+        rpc.cast(self.context, 'stoppable', {"method": "record",
+                                             "args": {"value": 2}})
+        for i in xrange(10):
+            greenthread.sleep(0)
+        self.assertEqual(received, [1])
+
+    def test_casts_reuse_pooled_publisher(self):
+        """Test that repeated casts share one cached publisher"""
+        for value in xrange(3):
+            rpc.cast(self.context, 'test', {"method": "echo",
+                                            "args": {"value": value}})
+        with rpc.ConnectionPool.item() as conn:
+            publishers = [publisher
+                          for publisher in conn.publishers.values()
+                          if publisher.routing_key == 'test']
+        self.assertEqual(len(publishers), 1)
+
+    def test_cast_reconnects_after_publish_failure(self):
+        """Test that a broken publisher is replaced and the send retried"""
+        with rpc.ConnectionPool.item() as conn:
+            publisher = conn.get_publisher(rpc.TopicPublisher, topic='test')
+
+        def _fail(*args, **kwargs):
+            raise IOError('Socket closed')
+
+        self.stubs.Set(publisher, 'send', _fail)
+        rpc.cast(self.context, 'test', {"method": "echo",
+                                        "args": {"value": 42}})
+        self.assertNotEqual(publisher,
+                            conn.get_publisher(rpc.TopicPublisher,
+                                               topic='test'))
+        result = rpc.call(self.context, 'test', {"method": "echo",
+                                                 "args": {"value": 42}})
+        self.assertEqual(42, result)
+
+    def test_call_does_not_hold_pooled_connection(self):
+        """Test that a call waiting for its reply leaves the pool free"""
+        self.stubs.Set(rpc, 'ConnectionPool',
+                       rpc.Pool(max_size=1, order_as_stack=True))
+        result = rpc.call(self.context, 'test', {"method": "echo",
+                                                 "args": {"value": 42}})
+        self.assertEqual(42, result)
+        self.assertEqual(rpc.ConnectionPool.free(), 1)
+
 
 class TestReceiver(object):
     """Simple Proxy class so the consumer has methods to call
@@ -126,7 +543,34 @@ class TestReceiver(object):
         LOG.debug(_("Received %s"), context)
         return context.to_dict()
 
+    @staticmethod
+    def sleep(context, value):
+        """Sleeps for value seconds before returning it"""
+        greenthread.sleep(value)
+        return value
+
+    @staticmethod
+    def count(context, value, fail=False):
+        """Generates the numbers below value, then raises if asked to"""
+        for i in xrange(value):
+            yield i
+        if fail:
+            raise Exception(value)
+
     @staticmethod
     def fail(context, value):
         """Raises an exception with the value sent in"""
         raise Exception(value)
+
+
+class BlockingReceiver(TestReceiver):
+    """Proxy class whose block method waits until unblock is sent"""
+
+    def __init__(self):
+        self.blocked = 0
+        self.unblock = event.Event()
+
+    def block(self, context):
+        """Counts the call and waits for unblock"""
+        self.blocked += 1
+        self.unblock.wait()
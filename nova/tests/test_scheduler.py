@@ -38,6 +38,7 @@ from nova.auth import manager as auth_manager
 from nova.scheduler import api
 from nova.scheduler import manager
 from nova.scheduler import driver
+from nova.scheduler import zone_clients
 from nova.compute import power_state
 from nova.db.sqlalchemy import models
 
@@ -57,6 +58,26 @@ class TestDriver(driver.Scheduler):
         return 'named_host'
 
 
+class BatchTestDriver(TestDriver):
+    """Scheduler Driver placing whole batches for Tests"""
+    def schedule_run_instances(self, context, instance_ids, *args, **kwargs):
+        return dict((instance_id, 'batch_host')
+                    for instance_id in instance_ids if instance_id != 3)
+
+
+class SelfProvisioningTestDriver(TestDriver):
+    """Scheduler Driver provisioning instances itself for Tests"""
+    def schedule_run_instance(self, context, instance_id, *args, **kwargs):
+        return None
+
+
+class FailingBatchTestDriver(TestDriver):
+    """Scheduler Driver failing after placing the first instance for Tests"""
+    def schedule_run_instances(self, context, instance_ids, *args, **kwargs):
+        db.instance_update(context, instance_ids[0], {'host': 'batch_host'})
+        raise driver.NoValidHost(_('No hosts were available'))
+
+
 class SchedulerTestCase(test.TestCase):
     """Test case for scheduler"""
     def setUp(self):
@@ -113,6 +134,81 @@ class SchedulerTestCase(test.TestCase):
         self.mox.ReplayAll()
         scheduler.named_method(ctxt, 'topic', num=7)
 
+    def test_run_instances_casts_once_per_host(self):
+        scheduler = manager.SchedulerManager()
+        self.mox.StubOutWithMock(rpc, 'cast_many', use_mock_anything=True)
+        ctxt = context.get_admin_context()
+        rpc.cast_many(ctxt,
+                      'compute.fallback_host',
+                      [{'method': 'run_instance',
+                        'args': {'instance_id': 1,
+                                 'availability_zone': 'zone1'}},
+                       {'method': 'run_instance',
+                        'args': {'instance_id': 2,
+                                 'availability_zone': 'zone1'}}])
+        self.mox.ReplayAll()
+        scheduler.run_instances(ctxt, 'compute', instance_ids=[1, 2],
+                                availability_zone='zone1')
+
+    def test_run_instances_schedules_batch_at_once(self):
+        scheduler = manager.SchedulerManager(
+                'nova.tests.test_scheduler.BatchTestDriver')
+        self.mox.StubOutWithMock(rpc, 'cast_many', use_mock_anything=True)
+        self.mox.StubOutWithMock(db, 'instance_set_state')
+        ctxt = context.get_admin_context()
+        db.instance_set_state(ctxt, 3, power_state.FAILED, 'error')
+        rpc.cast_many(ctxt,
+                      'compute.batch_host',
+                      [{'method': 'run_instance',
+                        'args': {'instance_id': 1}},
+                       {'method': 'run_instance',
+                        'args': {'instance_id': 2}}])
+        self.mox.ReplayAll()
+        scheduler.run_instances(ctxt, 'compute', instance_ids=[1, 2, 3])
+
+    def test_run_instances_leaves_self_provisioned_instances(self):
+        scheduler = manager.SchedulerManager(
+                'nova.tests.test_scheduler.SelfProvisioningTestDriver')
+        self.mox.StubOutWithMock(rpc, 'cast_many', use_mock_anything=True)
+        self.mox.StubOutWithMock(db, 'instance_set_state')
+        ctxt = context.get_admin_context()
+        self.mox.ReplayAll()
+        scheduler.run_instances(ctxt, 'compute', instance_ids=[1, 2])
+
+    def test_run_instances_keeps_placements_of_failed_batch(self):
+        scheduler = manager.SchedulerManager(
+                'nova.tests.test_scheduler.FailingBatchTestDriver')
+        instance_id1 = self._create_instance(host=None)['id']
+        instance_id2 = self._create_instance(host=None)['id']
+        self.mox.StubOutWithMock(rpc, 'cast_many', use_mock_anything=True)
+        ctxt = context.get_admin_context()
+        rpc.cast_many(ctxt,
+                      'compute.batch_host',
+                      [{'method': 'run_instance',
+                        'args': {'instance_id': instance_id1}}])
+        self.mox.ReplayAll()
+        scheduler.run_instances(ctxt, 'compute',
+                                instance_ids=[instance_id1, instance_id2])
+        instance_ref = db.instance_get(ctxt, instance_id1)
+        self.assertNotEqual(power_state.FAILED, instance_ref['state'])
+        instance_ref = db.instance_get(ctxt, instance_id2)
+        self.assertEqual(power_state.FAILED, instance_ref['state'])
+        self.assertEqual(None, instance_ref['host'])
+        db.instance_destroy(ctxt, instance_id1)
+        db.instance_destroy(ctxt, instance_id2)
+
+    def test_missed_capability_update_requests_snapshot(self):
+        scheduler = manager.SchedulerManager()
+        self.mox.StubOutWithMock(api, 'request_service_capabilities')
+        ctxt = context.get_admin_context()
+        api.request_service_capabilities(ctxt, 'compute', 'host1')
+        self.mox.ReplayAll()
+        scheduler.update_service_capabilities(ctxt, service_name='compute',
+                host='host1', capabilities={'a': 1}, sequence=1)
+        scheduler.update_service_capabilities(ctxt, service_name='compute',
+                host='host1', capabilities={'a': 2}, sequence=3,
+                removed=[], full=False)
+
     def test_show_host_resources_host_not_exit(self):
         """A host given as an argument does not exists."""
 
@@ -461,6 +557,106 @@ class SimpleDriverTestCase(test.TestCase):
         compute1.kill()
         compute2.kill()
 
+    def test_batch_spreads_instances_by_running_tally(self):
+        """Ensures a batch is spread as if placed one at a time"""
+        s1 = self._create_compute_service(host='host1')
+        s2 = self._create_compute_service(host='host2')
+        instance_id1 = self._create_instance(host='host1')
+        instance_ids = [self._create_instance(host=None)
+                        for i in xrange(3)]
+        self.mox.StubOutWithMock(db, 'service_get_all_compute_sorted')
+        db.service_get_all_compute_sorted(mox.IgnoreArg()).AndReturn(
+                db.IMPL.service_get_all_compute_sorted(self.context))
+        self.mox.ReplayAll()
+        hosts = self.scheduler.driver.schedule_run_instances(self.context,
+                                                             instance_ids)
+        self.assertEqual(hosts, {instance_ids[0]: 'host2',
+                                 instance_ids[1]: 'host2',
+                                 instance_ids[2]: 'host1'})
+        for instance_id in instance_ids:
+            instance_ref = db.instance_get(self.context, instance_id)
+            self.assertEqual(hosts[instance_id], instance_ref['host'])
+            self.assertNotEqual(None, instance_ref['scheduled_at'])
+            db.instance_destroy(self.context, instance_id)
+        db.instance_destroy(self.context, instance_id1)
+        db.service_destroy(self.context, s1['id'])
+        db.service_destroy(self.context, s2['id'])
+
+    def test_batch_leaves_out_instances_over_max_cores(self):
+        """Ensures a batch doesn't go over max cores"""
+        s1 = self._create_compute_service(host='host1')
+        s2 = self._create_compute_service(host='host2')
+        instance_ids = [self._create_instance(host=None)
+                        for i in xrange(FLAGS.max_cores * 2)]
+        instance_ids.append(self._create_instance(
+                availability_zone='nova:host1', host=None))
+        hosts = self.scheduler.driver.schedule_run_instances(self.context,
+                                                             instance_ids)
+        self.assertEqual(FLAGS.max_cores * 2, len(hosts))
+        self.assertEqual('host1', hosts[instance_ids[-1]])
+        self.assertFalse(instance_ids[-2] in hosts)
+        for instance_id in instance_ids:
+            db.instance_destroy(self.context, instance_id)
+        db.service_destroy(self.context, s1['id'])
+        db.service_destroy(self.context, s2['id'])
+
+    def test_usage_counts_own_placements_until_reconciled(self):
+        """Ensures placements are counted without reading the db again"""
+        s1 = self._create_compute_service(host='host1')
+        s2 = self._create_compute_service(host='host2')
+        instance_id1 = self._create_instance(host=None)
+        instance_id2 = self._create_instance(host=None)
+        self.mox.StubOutWithMock(db, 'service_get_all_compute_sorted')
+        db.service_get_all_compute_sorted(mox.IgnoreArg()).AndReturn(
+                db.IMPL.service_get_all_compute_sorted(self.context))
+        self.mox.ReplayAll()
+        host1 = self.scheduler.driver.schedule_run_instance(self.context,
+                                                            instance_id1)
+        host2 = self.scheduler.driver.schedule_run_instance(self.context,
+                                                            instance_id2)
+        self.assertNotEqual(host1, host2)
+        self.assertEqual({'host1': 1, 'host2': 1},
+                         self.scheduler.driver.usage['compute'].usage)
+        db.instance_destroy(self.context, instance_id1)
+        db.instance_destroy(self.context, instance_id2)
+        db.service_destroy(self.context, s1['id'])
+        db.service_destroy(self.context, s2['id'])
+
+    def test_periodic_tasks_reconciles_stale_usage(self):
+        """Ensures usage is read from the db again once it is stale"""
+        s1 = self._create_compute_service(host='host1')
+        usage = self.scheduler.driver.usage['compute']
+        usage.add('host1', 3)
+        utils.set_time_override()
+        try:
+            usage.reconcile(self.context)
+            self.assertEqual({'host1': 0}, usage.usage)
+            instance_id = self._create_instance(host='host1', vcpus=2)
+            self.scheduler.driver.periodic_tasks(self.context)
+            self.assertEqual({'host1': 0}, usage.usage)
+            utils.advance_time_seconds(FLAGS.host_usage_reconcile_interval)
+            self.scheduler.driver.periodic_tasks(self.context)
+            self.assertEqual({'host1': 2}, usage.usage)
+        finally:
+            utils.clear_time_override()
+        db.instance_destroy(self.context, instance_id)
+        db.service_destroy(self.context, s1['id'])
+
+    def test_saturated_usage_is_reconciled_before_failing(self):
+        """Ensures cores freed since the last reconcile are used again"""
+        s1 = self._create_compute_service(host='host1')
+        usage = self.scheduler.driver.usage['compute']
+        usage.reconcile(self.context)
+        # As if an instance that has since been deleted was placed here.
+        usage.add('host1', FLAGS.max_cores)
+        instance_id = self._create_instance(host=None)
+        host = self.scheduler.driver.schedule_run_instance(self.context,
+                                                           instance_id)
+        self.assertEqual('host1', host)
+        self.assertEqual({'host1': 1}, usage.usage)
+        db.instance_destroy(self.context, instance_id)
+        db.service_destroy(self.context, s1['id'])
+
     def test_least_busy_host_gets_volume(self):
         """Ensures the host with less gigabytes gets the next one"""
         volume1 = service.Service('host1',
@@ -936,6 +1132,11 @@ class FakeRerouteCompute(api.reroute_compute):
         return dict(magic="found me")
 
 
+class LocalRerouteCompute(api.reroute_compute):
+    def _call_child_zones(self, zones, function):
+        return [function(None, zone) for zone in zones]
+
+
 def go_boom(self, context, instance):
     raise exception.InstanceNotFound(instance_id=instance)
 
@@ -962,10 +1163,12 @@ class ZoneRedirectTest(test.TestCase):
 
         self.enable_zone_routing = FLAGS.enable_zone_routing
         FLAGS.enable_zone_routing = True
+        api.ZONE_LOCATIONS.clear()
 
     def tearDown(self):
         self.stubs.UnsetAll()
         FLAGS.enable_zone_routing = self.enable_zone_routing
+        api.ZONE_LOCATIONS.clear()
         super(ZoneRedirectTest, self).tearDown()
 
     def test_trap_found_locally(self):
@@ -989,6 +1192,44 @@ class ZoneRedirectTest(test.TestCase):
         self.assertRaises(exception.InstanceNotFound, decorator(go_boom),
                           None, None, 1)
 
+    def test_located_zone_is_asked_alone(self):
+        zones = [FakeZone(1, 'http://one.com', 'bob', 'xxx'),
+                 FakeZone(2, 'http://two.com', 'bob', 'xxx')]
+        asked = []
+
+        def _issue(nova, zone):
+            asked.append(zone.id)
+            if zone.id == 2:
+                return api._issue_novaclient_command(
+                        FakeNovaClient(FakeServerCollection()), zone,
+                        "servers", "get", 100)
+            return None
+
+        decorator = LocalRerouteCompute("get")
+        decorator._call_located_zones(zones, _issue, 100)
+        self.assertEquals(asked, [1, 2])
+        self.assertEquals(api.ZONE_LOCATIONS.get(100), (True, 2))
+        decorator._call_located_zones(zones, _issue, 100)
+        self.assertEquals(asked, [1, 2, 2])
+
+    def test_missing_instance_is_cached(self):
+        zones = [FakeZone(1, 'http://one.com', 'bob', 'xxx')]
+        asked = []
+
+        def _issue(nova, zone):
+            asked.append(zone.id)
+            return None
+
+        decorator = LocalRerouteCompute("get")
+        self.assertEquals(decorator._call_located_zones(zones, _issue, 7),
+                          [None])
+        self.assertEquals(decorator._call_located_zones(zones, _issue, 7),
+                          [])
+        self.assertEquals(asked, [1])
+        api.ZONE_LOCATIONS.invalidate(7)
+        decorator._call_located_zones(zones, _issue, 7)
+        self.assertEquals(asked, [1, 1])
+
     def test_get_collection_context_and_id(self):
         decorator = api.reroute_compute("foo")
         self.assertEquals(decorator.get_collection_context_and_id(
@@ -1088,9 +1329,11 @@ class CallZoneMethodTest(test.TestCase):
         self.stubs = stubout.StubOutForTesting()
         self.stubs.Set(db, 'zone_get_all', zone_get_all)
         self.stubs.Set(novaclient, 'OpenStack', FakeNovaClientOpenStack)
+        zone_clients.POOL.clear()
 
     def tearDown(self):
         self.stubs.UnsetAll()
+        zone_clients.POOL.clear()
         super(CallZoneMethodTest, self).tearDown()
 
     def test_call_zone_method(self):
@@ -1116,3 +1359,51 @@ class CallZoneMethodTest(test.TestCase):
         # test) should eventually handle real exceptions.
         expected = [(1, ('ERROR', 'testing'))]
         self.assertEqual(expected, results)
+
+
+class CountingNovaClientOpenStack(object):
+    created = 0
+
+    def __init__(self, *args, **kwargs):
+        CountingNovaClientOpenStack.created += 1
+        self.authentications = 0
+
+    def authenticate(self):
+        self.authentications += 1
+
+
+class ZoneClientPoolTest(test.TestCase):
+    def setUp(self):
+        super(ZoneClientPoolTest, self).setUp()
+        self.stubs = stubout.StubOutForTesting()
+        self.stubs.Set(novaclient, 'OpenStack', CountingNovaClientOpenStack)
+        CountingNovaClientOpenStack.created = 0
+        self.pool = zone_clients.ZoneClientPool()
+        self.zone = FakeZone(1, 'http://example.com', 'bob', 'xxx')
+
+    def tearDown(self):
+        self.stubs.UnsetAll()
+        utils.clear_time_override()
+        super(ZoneClientPoolTest, self).tearDown()
+
+    def test_reuses_authenticated_client(self):
+        clients = [self.pool.call(self.zone, lambda nova: nova)
+                   for i in xrange(3)]
+        self.assertEqual(1, CountingNovaClientOpenStack.created)
+        self.assertEqual(1, clients[0].authentications)
+
+    def test_authenticates_again_after_ttl(self):
+        utils.set_time_override()
+        nova = self.pool.call(self.zone, lambda nova: nova)
+        utils.advance_time_seconds(FLAGS.zone_client_token_ttl)
+        self.pool.call(self.zone, lambda nova: nova)
+        self.assertEqual(1, CountingNovaClientOpenStack.created)
+        self.assertEqual(2, nova.authentications)
+
+    def test_drops_client_after_error(self):
+        def fail(nova):
+            raise Exception('testing')
+
+        self.assertRaises(Exception, self.pool.call, self.zone, fail)
+        self.pool.call(self.zone, lambda nova: nova)
+        self.assertEqual(2, CountingNovaClientOpenStack.created)
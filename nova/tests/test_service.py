@@ -31,6 +31,7 @@ from nova import test
 from nova import service
 from nova import manager
 from nova.compute import manager as compute_manager
+from nova.scheduler import api as scheduler_api
 
 FLAGS = flags.FLAGS
 flags.DEFINE_string("fake_manager", "nova.tests.test_service.FakeManager",
@@ -43,6 +44,13 @@ class FakeManager(manager.Manager):
         return 'manager'
 
 
+class FakeSchedulerDependentManager(manager.SchedulerDependentManager):
+    """Fake manager sending capabilities for tests"""
+    def __init__(self, host=None, db_driver=None):
+        super(FakeSchedulerDependentManager, self).__init__(host, db_driver,
+                                                            'fake')
+
+
 class ExtendedService(service.Service):
     def test_method(self):
         return 'service'
@@ -68,6 +76,47 @@ class ServiceManagerTestCase(test.TestCase):
         self.assertEqual(serv.test_method(), 'service')
 
 
+class SchedulerDependentManagerTestCase(test.TestCase):
+    """Test cases for the capability updates of managers"""
+
+    def setUp(self):
+        super(SchedulerDependentManagerTestCase, self).setUp()
+        self.manager = FakeSchedulerDependentManager(host='host1')
+        self.context = context.get_admin_context()
+        self.mox.StubOutWithMock(scheduler_api, 'update_service_capabilities')
+
+    def test_sends_only_changed_capabilities(self):
+        scheduler_api.update_service_capabilities(self.context, 'fake',
+                'host1', {'a': 1, 'b': 2}, sequence=1, removed=[],
+                full=True)
+        scheduler_api.update_service_capabilities(self.context, 'fake',
+                'host1', {'a': 3}, sequence=2, removed=['b'], full=False)
+        self.mox.ReplayAll()
+        self.manager.update_service_capabilities({'a': 1, 'b': 2})
+        self.manager.periodic_tasks(self.context)
+        self.manager.update_service_capabilities({'a': 3})
+        self.manager.periodic_tasks(self.context)
+
+    def test_suppresses_unchanged_capabilities(self):
+        scheduler_api.update_service_capabilities(self.context, 'fake',
+                'host1', {'a': 1}, sequence=1, removed=[], full=True)
+        self.mox.ReplayAll()
+        self.manager.update_service_capabilities({'a': 1})
+        self.manager.periodic_tasks(self.context)
+        self.manager.update_service_capabilities({'a': 1})
+        self.manager.periodic_tasks(self.context)
+
+    def test_publish_sends_full_snapshot(self):
+        scheduler_api.update_service_capabilities(self.context, 'fake',
+                'host1', {'a': 1}, sequence=1, removed=[], full=True)
+        scheduler_api.update_service_capabilities(self.context, 'fake',
+                'host1', {'a': 1}, sequence=2, removed=[], full=True)
+        self.mox.ReplayAll()
+        self.manager.update_service_capabilities({'a': 1})
+        self.manager.periodic_tasks(self.context)
+        self.manager.publish_service_capabilities(self.context)
+
+
 class ServiceFlagsTestCase(test.TestCase):
     def test_service_enabled_on_create_based_on_flag(self):
         self.flags(enable_new_services=True)
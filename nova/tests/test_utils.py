@@ -275,3 +275,32 @@ class GenericUtilsTestCase(test.TestCase):
         # error case
         result = utils.parse_server_string('www.exa:mple.com:8443')
         self.assertEqual(('', ''), result)
+
+    def test_histogram(self):
+        histogram = utils.Histogram(bounds=(1, 2, 5))
+        for value in (0.5, 1.5, 1.5, 3, 7):
+            histogram.add(value)
+        self.assertEqual(histogram.counts, [1, 2, 1, 1])
+        stats = histogram.to_dict()
+        self.assertEqual(stats['count'], 5)
+        self.assertEqual(stats['total'], 13.5)
+        self.assertEqual(stats['mean'], 2.7)
+        self.assertEqual(stats['p50'], 2)
+        self.assertEqual(stats['p90'], 7)
+        self.assertEqual(stats['max'], 7)
+
+    def test_lru_cache(self):
+        cache = utils.LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertFalse('b' in cache)
+        self.assertEqual(cache.get('b', 'missing'), 'missing')
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        cache.set('a', 4)
+        cache.set('d', 5)
+        self.assertFalse('c' in cache)
+        self.assertEqual(cache.pop('a'), 4)
+        self.assertEqual(len(cache), 1)
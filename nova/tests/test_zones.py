@@ -104,6 +104,47 @@ class ZoneManagerTestCase(test.TestCase):
                                      svc1_c=(5, 5), svc10_a=(99, 99),
                                      svc10_b=(99, 99)))
 
+    def test_service_capabilities_rollup_drops_old_extremes(self):
+        zm = zone_manager.ZoneManager()
+        zm.update_service_capabilities("svc1", "host1", dict(a=1, b=5))
+        zm.update_service_capabilities("svc1", "host2", dict(a=10, b=7))
+        zm.update_service_capabilities("svc1", "host3", dict(a=4))
+        caps = zm.get_zone_capabilities(None)
+        self.assertEquals(caps, dict(svc1_a=(1, 10), svc1_b=(5, 7)))
+
+        zm.update_service_capabilities("svc1", "host2", dict(a=3))
+        caps = zm.get_zone_capabilities(None)
+        self.assertEquals(caps, dict(svc1_a=(1, 4), svc1_b=(5, 5)))
+        self.assertEquals(zm.capability_rollup.dirty, set())
+
+        zm.update_service_capabilities("svc1", "host1", dict())
+        caps = zm.get_zone_capabilities(None)
+        self.assertEquals(caps, dict(svc1_a=(3, 4)))
+
+    def test_service_capabilities_delta(self):
+        zm = zone_manager.ZoneManager()
+        self.assertTrue(zm.update_service_capabilities("svc1", "host1",
+                dict(a=1, b=2), sequence=1))
+        self.assertTrue(zm.update_service_capabilities("svc1", "host1",
+                dict(a=3), sequence=2, removed=['b'], full=False))
+        self.assertEquals(zm.service_states["host1"]["svc1"], dict(a=3))
+
+        self.assertFalse(zm.update_service_capabilities("svc1", "host1",
+                dict(a=5), sequence=4, removed=[], full=False))
+        self.assertEquals(zm.service_states["host1"]["svc1"], dict(a=3))
+
+        self.assertTrue(zm.update_service_capabilities("svc1", "host1",
+                dict(a=5, c=1), sequence=4))
+        self.assertTrue(zm.update_service_capabilities("svc1", "host1",
+                dict(c=2), sequence=5, removed=[], full=False))
+        self.assertEquals(zm.service_states["host1"]["svc1"], dict(a=5, c=2))
+
+    def test_service_capabilities_delta_from_unknown_host(self):
+        zm = zone_manager.ZoneManager()
+        self.assertFalse(zm.update_service_capabilities("svc1", "host1",
+                dict(a=1), sequence=7, removed=[], full=False))
+        self.assertEquals(zm.service_states, {})
+
     def test_refresh_from_db_replace_existing(self):
         zm = zone_manager.ZoneManager()
         zone_state = zone_manager.ZoneState()
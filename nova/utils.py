@@ -20,6 +20,7 @@
 """Utilities and helper functions."""
 
 import base64
+import bisect
 import datetime
 import functools
 import inspect
@@ -467,6 +468,118 @@ class LoopingCall(object):
         return self.done.wait()
 
 
+class Histogram(object):
+    """Counts values into buckets with fixed upper bounds.
+
+    The count, sum and maximum are kept as well, so means and approximate
+    percentiles can be reported without storing every value. The default
+    bounds suit latencies in seconds.
+
+    """
+
+    BOUNDS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+              0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, bounds=None):
+        self.bounds = bounds or self.BOUNDS
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, percent):
+        """Returns the upper bound of the bucket holding the percentile."""
+        rank = self.count * percent / 100.0
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen and seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {'count': self.count,
+                'total': self.total,
+                'mean': self.count and self.total / self.count,
+                'p50': self.percentile(50),
+                'p90': self.percentile(90),
+                'p99': self.percentile(99),
+                'max': self.max}
+
+
+class LRUCache(object):
+    """Mapping that holds at most max_size items.
+
+    Adding an item to a full cache evicts the least recently used one.
+    Items are kept in a circular doubly linked list, most recently used
+    first, so every operation takes constant time.
+
+    """
+
+    _PREV, _NEXT, _KEY, _VALUE = 0, 1, 2, 3
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.clear()
+
+    def clear(self):
+        self._links = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+
+    def __len__(self):
+        return len(self._links)
+
+    def __contains__(self, key):
+        return key in self._links
+
+    def _unlink(self, link):
+        link[self._PREV][self._NEXT] = link[self._NEXT]
+        link[self._NEXT][self._PREV] = link[self._PREV]
+
+    def _link_first(self, link):
+        first = self._root[self._NEXT]
+        link[self._PREV] = self._root
+        link[self._NEXT] = first
+        first[self._PREV] = link
+        self._root[self._NEXT] = link
+
+    def get(self, key, default=None):
+        link = self._links.get(key)
+        if link is None:
+            return default
+        self._unlink(link)
+        self._link_first(link)
+        return link[self._VALUE]
+
+    def set(self, key, value):
+        link = self._links.get(key)
+        if link is not None:
+            self._unlink(link)
+            link[self._VALUE] = value
+        else:
+            if len(self._links) >= self.max_size:
+                last = self._root[self._PREV]
+                self._unlink(last)
+                del self._links[last[self._KEY]]
+            link = [None, None, key, value]
+            self._links[key] = link
+        self._link_first(link)
+
+    def pop(self, key, default=None):
+        link = self._links.pop(key, None)
+        if link is None:
+            return default
+        self._unlink(link)
+        return link[self._VALUE]
+
+
 def xhtml_escape(value):
     """Escapes a string so it is valid within XML or XHTML.
 